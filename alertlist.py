@@ -0,0 +1,245 @@
+"""
+Parser and serializer for the {{Alert list}} template on the Alerts page.
+
+The template holds numbered groups of parameters, one group per alert:
+
+    {{Alert list
+    | type1   = flagged-domain
+    | msg1    = ...
+    | action1 = ...
+    | time1   = ~~~~~
+    }}
+
+AlertList.parse turns a page into the text around the template plus a list of
+Alert records, newest first. New alerts are prepended in constant time each,
+duplicates of alerts already listed are dropped, rotate() removes the oldest
+alerts for archiving, and serialize() renumbers and aligns every parameter in
+a single pass over the list.
+"""
+
+import datetime
+import re
+from collections import deque, namedtuple
+
+# The parameters of one alert, in the order they are written
+alert_params = ("type", "msg", "action", "time")
+
+Alert = namedtuple("Alert", alert_params + ("extra",), defaults=(None, None, None, ()))
+Alert.__doc__ = """
+One alert of the list. extra holds any other numbered parameters of the
+alert as (name, value) tuples.
+"""
+
+param_pattern = re.compile(r'^\|\s*([A-Za-z_]+?)(\d+)\s*=\s?(.*)$')
+
+template_start = "{{Alert list"
+
+# Timestamp left by a ~~~~~ signature, e.g. "14:32, 17 October 2026 (UTC)"
+signature_time_pattern = re.compile(r'(\d{1,2}:\d{2}), (\d{1,2} [A-Z][a-z]+ \d{4}) \(UTC\)')
+
+def alert_time(alert, default):
+    """
+    Reads when an alert was posted from its time parameter.
+
+    Args:
+        alert (Alert): The alert.
+        default (datetime.datetime): Time to assume for an alert without a
+                                     signature timestamp, such as one not
+                                     saved yet.
+
+    Returns:
+        datetime.datetime: The time the alert was posted, in UTC.
+    """
+    match = signature_time_pattern.search(alert.time or "")
+    if match is None:
+        return default
+    try:
+        return datetime.datetime.strptime(" ".join(match.groups()), "%H:%M %d %B %Y")
+    except ValueError:
+        return default
+
+def alert_key(alert):
+    """
+    Identifies an alert for deduplication, ignoring its timestamp.
+
+    Args:
+        alert (Alert): The alert.
+
+    Returns:
+        tuple: The alert's type and message.
+    """
+    return alert.type, alert.msg
+
+def find_template_end(wikitext, start):
+    """
+    Finds the end of the template starting at an index, skipping over the
+    templates nested in its parameters.
+
+    Args:
+        wikitext (str): The page wikitext.
+        start (int): Index of the template's opening braces.
+
+    Returns:
+        int: Index just past the template's closing braces.
+
+    Raises:
+        ValueError: If the template is not closed.
+    """
+    depth = 0
+    index = start
+    while True:
+        opening = wikitext.find("{{", index)
+        closing = wikitext.find("}}", index)
+        if closing == -1:
+            raise ValueError("Unclosed {{Alert list}} template")
+        if opening != -1 and opening < closing:
+            depth += 1
+            index = opening + 2
+        else:
+            depth -= 1
+            index = closing + 2
+            if depth == 0:
+                return index
+
+class AlertList:
+    """
+    The {{Alert list}} template of a page, as alert records.
+    """
+
+    def __init__(self, before="", header=(), alerts=(), after=""):
+        """
+        Args:
+            before (str, optional): Page text before the template.
+            header (Sequence[str], optional): Unnumbered parameter lines of
+                                              the template.
+            alerts (Iterable[Alert], optional): The alerts, newest first.
+            after (str, optional): Page text after the template.
+        """
+        self.before = before
+        self.header = list(header)
+        self.alerts = deque(alerts)
+        self.after = after
+        self.keys = {alert_key(alert) for alert in self.alerts}
+
+    @classmethod
+    def parse(cls, wikitext):
+        """
+        Parses the first {{Alert list}} template of a page.
+
+        Args:
+            wikitext (str): The page wikitext.
+
+        Returns:
+            AlertList: The parsed template.
+
+        Raises:
+            ValueError: If the page has no closed {{Alert list}} template.
+        """
+        start = wikitext.index(template_start)
+        end = find_template_end(wikitext, start)
+        body = wikitext[start + len(template_start):end - 2]
+
+        header = []
+        groups = {}
+        last_param = None
+        for line in body.split("\n"):
+            match = param_pattern.match(line)
+            if match:
+                name, number, value = match.groups()
+                group = groups.setdefault(int(number), {})
+                group[name] = value.rstrip()
+                last_param = group, name
+            elif not line.strip():
+                continue
+            elif line.startswith("|"):
+                header.append(line)
+                last_param = None
+            elif last_param is not None:
+                # Continuation of a multi-line value
+                group, name = last_param
+                group[name] += "\n" + line.rstrip()
+
+        alerts = []
+        for number in sorted(groups):
+            group = groups[number]
+            values = [group.pop(param, None) for param in alert_params]
+            alerts.append(Alert(*values, extra=tuple(group.items())))
+
+        return cls(wikitext[:start], header, alerts, wikitext[end:])
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def __iter__(self):
+        return iter(self.alerts)
+
+    def prepend(self, alerts):
+        """
+        Adds alerts to the top of the list, keeping their order and skipping
+        any alert already listed.
+
+        Args:
+            alerts (Sequence[Alert]): The new alerts.
+
+        Returns:
+            int: Number of alerts added.
+        """
+        added = 0
+        for alert in reversed(alerts):
+            key = alert_key(alert)
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            self.alerts.appendleft(alert)
+            added += 1
+        return added
+
+    def rotate(self, keep, since, now):
+        """
+        Removes the oldest alerts from the bottom of the list until at most
+        keep remain and none is older than since. Only the removed alerts
+        are looked at.
+
+        Args:
+            keep (int): Maximum number of alerts to keep.
+            since (datetime.datetime): Oldest posting time to keep, or None.
+            now (datetime.datetime): Time to assume for undated alerts.
+
+        Returns:
+            List[Alert]: The removed alerts, newest first.
+        """
+        removed = []
+        while self.alerts:
+            oldest = self.alerts[-1]
+            too_old = since is not None and alert_time(oldest, now) < since
+            if len(self.alerts) <= keep and not too_old:
+                break
+            self.alerts.pop()
+            self.keys.discard(alert_key(oldest))
+            removed.append(oldest)
+        removed.reverse()
+        return removed
+
+    def serialize(self):
+        """
+        Writes the page back, numbering the alerts from the top and aligning
+        the equal signs of every parameter.
+
+        Returns:
+            str: The page wikitext.
+        """
+        longest_name = max(
+            [len(param) for param in alert_params]
+            + [len(name) for alert in self.alerts for name, _ in alert.extra]
+        )
+        width = longest_name + len(str(len(self.alerts)))
+
+        lines = [self.before + template_start]
+        lines.extend(self.header)
+        for number, alert in enumerate(self.alerts, 1):
+            params = [(param, getattr(alert, param)) for param in alert_params]
+            for name, value in params + list(alert.extra):
+                if value is not None:
+                    lines.append(f"| {name + str(number):<{width}} = {value}")
+        lines.append("}}" + self.after)
+        return "\n".join(lines)
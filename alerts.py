@@ -1,11 +1,54 @@
-import re
-import requests
+import datetime
+import resources
+import transport
+from alertlist import Alert, AlertList, alert_time
 from utility import *
 from db import *
 
+ALERTS_PAGE = "Wikipedia:Vaccine safety/Alerts"
+
+# Alerts kept on the live page: at most ALERTS_KEPT of them, none older than
+# ALERTS_KEPT_DAYS days. Older alerts move to monthly archive subpages.
+ALERTS_KEPT = 200
+ALERTS_KEPT_DAYS = 90
+
+# Frequently used domains of the current snapshot not alerted on yet
+frequent_domains_query = f"""
+    SELECT domains.id, domains.domain, domain_usage.link_count AS count
+    FROM domain_usage
+    JOIN domains ON domain_usage.domain_id = domains.id
+    WHERE domain_usage.run_id = %s
+        AND domain_usage.link_count >= {FREQUENT_DOMAIN_MIN_LINKS}
+        AND domains.frequent_domain_notification IS NULL
+    ORDER BY count DESC
+"""
+
+# Articles of the current snapshot linking to flagged domains, with links
+# not alerted on yet
+flagged_articles_query = f"""
+    SELECT DISTINCT domains.id, domains.domain, domain_usage.status, domain_articles.url_appeared_on
+    FROM domain_usage
+    JOIN domains ON domain_usage.domain_id = domains.id
+    JOIN domain_articles ON domain_articles.run_id = domain_usage.run_id
+        AND domain_articles.domain_id = domain_usage.domain_id
+    JOIN urls ON urls.domain_id = domain_articles.domain_id
+        AND urls.url_appeared_on_hash = domain_articles.url_appeared_on_hash
+    WHERE domain_usage.run_id = %s
+        AND {status_condition('flagged', 'domain_usage.status')}
+        AND urls.appeared_on_article_notification IS NULL
+    ORDER BY domains.domain, domain_articles.url_appeared_on
+"""
+
+# Every query the alerts stage runs against the current snapshot, by name
+alert_queries = {
+    "frequent_domains": frequent_domains_query,
+    "flagged_articles": flagged_articles_query,
+}
+
 def get_domains_and_counts(connection):
     """
-    Retrieves domain names and number of usages from the database.
+    Retrieves domain names and number of usages in the current snapshot from
+    the database.
 
     Args:
         connection (pymysql.connections.Connection): Database connection.
@@ -14,166 +57,132 @@ def get_domains_and_counts(connection):
         List[Tuple[int, str, int]]: List of tuples containing domain_id, domain name, and count.
     """
     cursor = connection.cursor()
-    query = """
-        SELECT domains.id, domains.domain, COUNT(urls.domain_id) AS count
-        FROM urls
-        JOIN domains ON urls.domain_id = domains.id
-        WHERE urls.last_updated = (SELECT MAX(last_updated) FROM urls) AND domains.frequent_domain_notification IS NULL
-        GROUP BY urls.domain_id
-        HAVING COUNT(urls.domain_id) >= 10
-        ORDER BY count DESC;
-    """
-
-    cursor.execute(query)
+    cursor.execute(frequent_domains_query, (get_current_run(connection),))
     result = cursor.fetchall()
     cursor.close()
     return result
 
-def insert_alerts(alerts, wikitext):
-    """
-    Inserts the new alerts into the existing wikitext.
-
-    Args:
-        alerts (List[str]): List of new alerts to be inserted.
-        wikitext (str): The current wikitext.
-
-    Returns:
-        str: Updated wikitext with new alerts inserted.
-    """
-    start_index = wikitext.index("{{Alert list") + len("{{Alert list")
-
-    for alert in reversed(alerts):
-        wikitext = wikitext[:start_index] + "\n" + alert + wikitext[start_index:]
-
-    return wikitext
-
-def load_wikitext(url):
-    """
-    Fetches wikitext from the specified URL.
-
-    Args:
-        url (str): URL to fetch the wikitext from.
-
-    Returns:
-        str: Wikitext fetched from the URL or None if there is an error.
+def load_wikitext(title):
     """
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.text
-    else:
-        print(f"Error while loading wikitext from URL: {response.status_code}")
-        return None
-
-def renumber_and_align(wikitext):
-    """
-    Renumber the notifications and align the parameter names, equal signs, and values in the wikitext.
+    Fetches the wikitext of a page through the run's publisher, which reads
+    it through the HTTP transport and later compares the new content against
+    it without fetching it again.
 
     Args:
-        wikitext (str): The misnumbered wikitext
+        title (str): The page title.
 
     Returns:
-        str: Renumbered and aligned wikitext.
+        str: Wikitext of the page or None if the page does not exist.
     """
-    lines = wikitext.split('\n')
-    counter = 1
-
-    for i, line in enumerate(lines):
-        if re.match(r'\| type\d+ *=', line):
-            lines[i] = f"| type{counter}   =" + line.split('=', 1)[1]
-            counter += 1
-
-        for param in ['msg', 'action', 'time']:
-            if re.match(fr'\| {param}\d+ *=', line):
-                lines[i] = f"| {param}{counter - 1}   =" + line.split('=', 1)[1]
-
-    return '\n'.join(lines)
+    return resources.get("publisher").get_text(title)
 
 def get_flagged_domains_and_articles(connection):
     """
-    Retrieves flagged domains and articles from the database.
+    Retrieves the articles of the current snapshot linking to flagged
+    domains that have not been alerted on yet.
 
     Args:
         connection (pymysql.connections.Connection): Database connection.
 
     Returns:
-        List[Tuple[str, int, str]]: List of tuples containing domain, status, and url_appeared_on.
+        List[Tuple[int, str, int, str]]: List of tuples containing domain_id, domain, status,
+                                         and url_appeared_on.
     """
     cursor = connection.cursor()
-    query = """
-        SELECT domains.domain, domains.status, urls.url_appeared_on
-        FROM urls
-        JOIN domains ON urls.domain_id = domains.id
-        WHERE urls.appeared_on_article_notification IS NULL
-            AND domains.status IN (3, 4, 5, 6);
-    """
-
-    cursor.execute(query)
+    cursor.execute(flagged_articles_query, (get_current_run(connection),))
     result = cursor.fetchall()
     cursor.close()
     return result
 
-def format_alert_string(i, type_line, msg_line, action_line, time_line):
-    """
-    Formats template parameters with given parameters.
-
-    Args:
-        i (int): Alert index.
-        type_line (str): Alert "type" parameter.
-        msg_line (str): Alert "message" parameter.
-        action_line (str): Alert "action" parameter.
-        time_line (str): Alert "time" parameter.
-
-    Returns:
-        str: Formatted alert string.
-    """
-    return f"""| type{i}   = {type_line}
-| msg{i}     = {msg_line}
-| action{i}  = {action_line}
-| time{i}    = {time_line}"""
-
 def create_alerts(alert_type, data):
     """
-    Creates template parameters for Alert list call
+    Creates Alert list records for new alerts.
 
     Args:
         alert_type (str): Type of the alert ("frequent-domain" or "flagged-domain").
         data (List[Tuple]): List of tuples containing the data to generate alerts.
 
     Returns:
-        List[str]: List of alert strings.
+        List[Alert]: List of alert records.
     """
     alerts = []
 
-    for i, item in enumerate(data, 1):
+    for item in data:
         if alert_type == "frequent-domain":
             domain_id, domain, count = item
-            type_line = alert_type
             msg_line = f"'''{domain}''' appears {count} times on articles"
             action_line = "[[Wikipedia:Vaccine safety/Reports#Frequent domain use|view report]]"
 
         elif alert_type == "flagged-domain":
-            domain, status, article = item
-            article = to_wikilinks(article).replace('[[', '').replace(']]', '')
+            domain_id, domain, status, article = item
+            article = url_to_title(article)
             history_link = get_history_link(article)
-            type_line = alert_type
             msg_line = f"'''{domain}''' (marked as {{{{vsrate|{status_to_template[status]}}}}}) appears in '''[[{article}]]'''"
             action_line = f"[{history_link} view article history]"
 
-        time_line = "~~~~~"
-        alert = format_alert_string(i, type_line, msg_line, action_line, time_line)
-        alerts.append(alert)
+        alerts.append(Alert(type=alert_type, msg=msg_line, action=action_line, time="~~~~~"))
 
     return alerts
 
-def get_alerts_page():
+def archive_title(posted):
     """
-    Generates the updated alerts page wikitext with new frequent-domain and flagged-domain alerts.
+    Names the archive subpage of the alerts posted in a month.
+
+    Args:
+        posted (datetime.datetime): When the alert was posted.
+
+    Returns:
+        str: The archive page title.
+    """
+    return f"{ALERTS_PAGE}/Archive {posted:%Y-%m}"
+
+def archive_alerts(alerts, now):
+    """
+    Adds alerts rotated off the live page to the top of their monthly
+    archive subpages, creating the subpages that do not exist yet.
+
+    Args:
+        alerts (List[Alert]): The rotated alerts, newest first.
+        now (datetime.datetime): Time to assume for undated alerts.
 
     Returns:
-        str: Updated alerts page wikitext.
+        dict: A mapping of archive page title to its updated wikitext.
     """
-    connection = create_conn()
-    if connection:
+    alerts_by_title = {}
+    for alert in alerts:
+        alerts_by_title.setdefault(archive_title(alert_time(alert, now)), []).append(alert)
+
+    pages = {}
+    for title, archived in alerts_by_title.items():
+        wikitext = load_wikitext(title)
+        if wikitext:
+            archive = AlertList.parse(wikitext)
+        else:
+            archive = AlertList(before=f"Alerts archived from [[{ALERTS_PAGE}]].\n\n")
+        archive.prepend(archived)
+        pages[title] = archive.serialize()
+    return pages
+
+def get_alerts_pages(session=None, now=None, wikitext=None):
+    """
+    Generates the updated alerts page wikitext with new frequent-domain and
+    flagged-domain alerts, moving the oldest alerts to the archive subpages.
+
+    Args:
+        session (db.Session, optional): Database session shared with the other
+                                        bot stages.
+        now (datetime.datetime, optional): Current UTC time.
+        wikitext (str, optional): The current alerts page wikitext, if it has
+                                  already been fetched.
+
+    Returns:
+        dict: A mapping of page title to its updated wikitext: the archive
+              pages first, then the alerts page. Empty if the alerts page
+              does not exist.
+    """
+    now = now or datetime.datetime.utcnow()
+
+    with stage_connection(session, "alerts") as connection:
         domains_and_counts = get_domains_and_counts(connection)
         flagged_domains_and_articles = get_flagged_domains_and_articles(connection)
 
@@ -182,31 +191,48 @@ def get_alerts_page():
 
         alerts = frequent_domain_alerts + flagged_domain_alerts
 
-        wikitext = load_wikitext("https://en.wikipedia.org/wiki/Wikipedia:Vaccine_safety/Alerts?action=raw")
-
-        if wikitext:
-            updated_wikitext = insert_alerts(alerts, wikitext)
-            final_wikitext = renumber_and_align(updated_wikitext)
-            print(final_wikitext)
-
-            update_column_with_conditions(
-                connection,
-                "domains",
-                "frequent_domain_notification",
-                1,
-                [(("id", domain_id),) for domain_id, _, _ in domains_and_counts]
-            )
-
-            update_column_with_conditions(
-                connection,
-                "urls",
-                "appeared_on_article_notification",
-                1,
-                [(("domain_id", domain), ("url_appeared_on", article)) for domain, _, article in flagged_domains_and_articles]
-            )
-
-            connection.close()
-            return final_wikitext
+        wikitext = wikitext or load_wikitext(ALERTS_PAGE)
+
+        if not wikitext:
+            return {}
+
+        alert_list = AlertList.parse(wikitext)
+        added = alert_list.prepend(alerts)
+        print(f"{added} new alerts, {len(alerts) - added} already listed")
+
+        rotated = alert_list.rotate(
+            ALERTS_KEPT, now - datetime.timedelta(days=ALERTS_KEPT_DAYS), now
+        )
+        pages = archive_alerts(rotated, now)
+        if rotated:
+            print(f"{len(rotated)} alerts moved to {', '.join(pages)}")
+
+        pages[ALERTS_PAGE] = alert_list.serialize()
+        print(pages[ALERTS_PAGE])
+
+        if transport.dry_run():
+            print("Dry run: alerts not marked as notified")
+            return pages
+
+        bulk_update_column(
+            connection,
+            "domains",
+            "frequent_domain_notification",
+            1,
+            ("id",),
+            [(domain_id,) for domain_id, _, _ in domains_and_counts]
+        )
+
+        bulk_update_column(
+            connection,
+            "urls",
+            "appeared_on_article_notification",
+            1,
+            ("domain_id", "url_appeared_on_hash"),
+            [(domain_id, url_hash(article)) for domain_id, _, _, article in flagged_domains_and_articles]
+        )
+
+        return pages
 
 if __name__ == "__main__":
-    get_alerts_page()
+    get_alerts_pages()
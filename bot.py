@@ -1,33 +1,111 @@
-import check_references, reports, alerts
-import pywikibot
+import argparse
+import instrument
+import pipeline
+import resources
+import transport
+
+REPORTS_PAGE = "Wikipedia:Vaccine safety/Reports"
 
 def update_wiki_page(page_title, new_content):
-    site = pywikibot.Site()
-    page = pywikibot.Page(site, page_title)
+    # Saves through the run's publisher, which skips unchanged content
+    resources.get("publisher").publish(page_title, new_content)
+
+def snapshot_fingerprint(session):
+    # Contents of the snapshot the reports and alerts are computed from
+    import reports
+
+    with session.stage("fingerprint") as connection:
+        return reports.snapshot_fingerprint(connection)
+
+def require(inputs, stage):
+    # Output of a dependency the stage cannot do without
+    if stage not in inputs:
+        raise ValueError(f"This stage needs the output of the {stage} stage; select it too")
+    return inputs[stage]
 
-    # Check if the page exists and if the new content is different
-    if page.exists() and page.text != new_content:
-        page.text = new_content
-        page.save(f"Updating {page_title} with new content")
-        print(f"{page_title} has been updated.")
-    else:
-        print(f"{page_title} does not exist or has no changes.")
+def build_stages(session, resume=False):
+    """
+    Declares the stages of a bot run and their dependencies. After the crawl,
+    the report and the alerts are computed independently, and the current
+    Alerts page is fetched while the crawl runs.
 
-def main():
-    # Refreshing reference database
-    check_references.go()
+    Args:
+        session (db.Session): Database session shared by the stages.
+        resume (bool, optional): Continue the most recent interrupted crawl.
 
-    # Generating contents of [[Wikipedia:Vaccine safety/Reports]]
-    Reports_content = reports.generate_wikipage()
+    Returns:
+        List[pipeline.Stage]: The stages.
+    """
+    # Stage modules are imported here so that importing bot stays cheap
+    import check_references, reports, alerts, publish
 
-    # Update [[Wikipedia:Vaccine Safety/Reports]] page
-    update_wiki_page("Wikipedia:Vaccine safety/Reports", Reports_content)
+    def alerts_fingerprint(inputs):
+        base = inputs.get("fetch_alerts_page") or ""
+        return snapshot_fingerprint(session) + ":" + publish.content_hash(base)
 
-    # Generating contents of [[Wikipedia:Vaccine safety/Alerts]]
-    Alerts_content = alerts.get_alerts_page()
+    return [
+        # Refreshing reference database
+        pipeline.Stage(
+            "crawl",
+            lambda inputs: check_references.go(resume=resume, session=session)
+        ),
+        # Generating contents of [[Wikipedia:Vaccine safety/Reports]]
+        pipeline.Stage(
+            "reports",
+            lambda inputs: reports.generate_wikipage(session),
+            deps=("crawl",),
+            fingerprint=lambda inputs: snapshot_fingerprint(session)
+        ),
+        # Update [[Wikipedia:Vaccine Safety/Reports]] page
+        pipeline.Stage(
+            "publish_reports",
+            lambda inputs: update_wiki_page(REPORTS_PAGE, require(inputs, "reports")),
+            deps=("reports",)
+        ),
+        # Fetching the current [[Wikipedia:Vaccine safety/Alerts]]
+        pipeline.Stage(
+            "fetch_alerts_page",
+            lambda inputs: alerts.load_wikitext(alerts.ALERTS_PAGE)
+        ),
+        # Generating contents of [[Wikipedia:Vaccine safety/Alerts]] and of
+        # the archive subpages receiving its oldest alerts
+        pipeline.Stage(
+            "alerts",
+            lambda inputs: alerts.get_alerts_pages(
+                session, wikitext=inputs.get("fetch_alerts_page")
+            ),
+            deps=("crawl", "fetch_alerts_page"),
+            fingerprint=alerts_fingerprint
+        ),
+        # Update the archives first, so rotated alerts are never missing from both
+        pipeline.Stage(
+            "publish_alerts",
+            lambda inputs: resources.get("publisher").publish_all(require(inputs, "alerts")),
+            deps=("alerts",)
+        ),
+    ]
 
-    # Update [[Wikipedia:Vaccine Safety/Alerts]] page
-    update_wiki_page("Wikipedia:Vaccine safety/Alerts", Alerts_content)
+def main(resume=False, stages=None, force=False):
+    # One pooled database session is shared by every stage of the run
+    session = resources.get("session")
+    try:
+        # Recording and replaying runs save nothing, so they must not mark
+        # their stages as done for the next live run either
+        pipeline.run_stages(build_stages(session, resume), selected=stages, force=force,
+                            save=not transport.dry_run())
+    finally:
+        resources.close()
+        # Written for failed runs too, where the timings matter most
+        instrument.write()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Update the Vaccine safety reports and alerts")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the most recent interrupted reference crawl")
+    parser.add_argument("--stages", nargs="+", metavar="STAGE",
+                        help="run only these stages: crawl, reports, publish_reports, "
+                             "fetch_alerts_page, alerts, publish_alerts")
+    parser.add_argument("--force", action="store_true",
+                        help="run stages even if their inputs are unchanged")
+    args = parser.parse_args()
+    main(resume=args.resume, stages=args.stages, force=args.force)
@@ -1,150 +1,799 @@
+import argparse
 import datetime
-import pymysql
-import re
-import requests
-from tld import get_fld
-from urllib.parse import urlparse
-from credentials import hostname, dbname, username, password
-from pageset import get_list
+import time
+import dumps
+import instrument
+from db import stage_connection, url_hash
+from storage import get_storage
+from fetch import Fetcher
+from normalize import urls_to_domains
+from utility import status_buckets, status_condition, listed_domain_condition
 
-def get_external_links_and_domains(article_url):
+# Concurrency and politeness settings for the reference crawl
+FETCH_WORKERS = 4
+REQUESTS_PER_SECOND = 5
+
+# The API accepts at most 50 titles per query for ordinary accounts
+MAX_TITLES_PER_QUERY = 50
+
+# Number of urls rows sent per multi-row upsert
+URL_CHUNK_SIZE = 1000
+
+def get_external_links_and_domains(article_url, fetcher=None):
     """
     Retrieves external links and their corresponding domains from a given
     Wikipedia article.
 
     Args:
         article_url (str): The URL of the Wikipedia article.
+        fetcher (fetch.Fetcher, optional): Fetcher to issue API requests with.
+                                           A single-worker fetcher is created
+                                           and closed here if not given.
 
     Yields:
         tuple: A tuple containing the external link and its domain.
     """
-    article_title = article_url.replace("https://en.wikipedia.org/wiki/", "").replace("_", " ")
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher(workers=1)
+    try:
+        for _, link, domain in get_external_links_and_domains_batched([article_url], fetcher):
+            yield link, domain
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
+def article_url_to_title(article_url):
+    """
+    Converts a Wikipedia article URL to the page title used by the API.
+
+    Args:
+        article_url (str): The URL of the Wikipedia article.
+
+    Returns:
+        str: The article title.
+    """
+    return article_url.replace("https://en.wikipedia.org/wiki/", "").replace("_", " ")
+
+def get_external_links_batch(article_urls, fetcher):
+    """
+    Retrieves the external links of several Wikipedia articles with a single
+    multi-title query, following "continue" across the whole batch.
+
+    Args:
+        article_urls (list): Up to MAX_TITLES_PER_QUERY Wikipedia article URLs.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
+
+    Returns:
+        dict: A mapping of article URL to the list of raw external links found
+              on that article.
+    """
+    titles = {article_url_to_title(url): url for url in article_urls}
     api_url = "https://en.wikipedia.org/w/api.php"
     params = {
         "action": "query",
         "format": "json",
         "prop": "extlinks",
-        "titles": article_title,
-        "ellimit": "max"
+        "titles": "|".join(titles),
+        "ellimit": "max",
+        "maxlag": 5
     }
 
+    links = {url: [] for url in article_urls}
     while True:
-        response = requests.get(api_url, params=params)
-        data = response.json()
+        data = fetcher.get_json(api_url, params=params)
+
+        # The API reports titles it had to normalize (e.g. a lowercase first
+        # letter) so results can be mapped back to the requested titles
+        for entry in data["query"].get("normalized", []):
+            if entry["from"] in titles:
+                titles[entry["to"]] = titles[entry["from"]]
 
         for page in data["query"]["pages"].values():
-            for extlink in page.get("extlinks", []):
-                link = extlink["*"]
+            article_url = titles.get(page.get("title"))
+            if article_url is None:
+                continue
+            links[article_url].extend(
+                extlink["*"] for extlink in page.get("extlinks", [])
+            )
 
-                # Remove web.archive.org prefix if present
-                archive_prefix = r'^https://web\.archive\.org/web/\d{14}/'
-                link = re.sub(archive_prefix, '', link)
+        if "continue" not in data:
+            break
 
-                try:
-                    domain = get_fld(link, fail_silently=True)
-                except Exception:
-                    continue
+        params.update(data["continue"])
 
-                if not domain:
-                    # If domain is an IP address with no TLD
-                    ip_pattern = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
-                    domain_match = ip_pattern.match(link)
+    return links
 
-                    if domain_match:
-                        domain = domain_match.group()
+def get_external_link_batches(article_urls, fetcher):
+    """
+    Retrieves external links and their corresponding domains for a list of
+    Wikipedia articles, packing MAX_TITLES_PER_QUERY titles into each query.
+    Batches are fetched concurrently on the fetcher's worker pool and yielded
+    as they complete.
 
+    Args:
+        article_urls (list): A list of Wikipedia article URLs.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
+
+    Yields:
+        tuple: One tuple per batch containing the batch's article URLs and a
+               list of tuples of the article URL, the external link and its
+               domain.
+    """
+    article_urls = list(article_urls)
+    batches = (
+        article_urls[i:i + MAX_TITLES_PER_QUERY]
+        for i in range(0, len(article_urls), MAX_TITLES_PER_QUERY)
+    )
+    for result in fetcher.imap_unordered(
+        lambda batch: get_external_links_batch(batch, fetcher), batches
+    ):
+        links_and_domains = []
+        for article_url, links in result.items():
+            for link, domain in urls_to_domains(links):
                 if domain:
-                    yield link, domain
+                    links_and_domains.append((article_url, link, domain))
+        yield list(result), links_and_domains
 
-        if "continue" not in data:
-            break
+def get_external_links_and_domains_batched(article_urls, fetcher):
+    """
+    Retrieves external links and their corresponding domains for a list of
+    Wikipedia articles, packing MAX_TITLES_PER_QUERY titles into each query.
 
-        params.update(data["continue"])
+    Args:
+        article_urls (list): A list of Wikipedia article URLs.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
+
+    Yields:
+        tuple: A tuple containing the article URL, the external link and its
+               domain.
+    """
+    for _, links_and_domains in get_external_link_batches(article_urls, fetcher):
+        yield from links_and_domains
 
-def remove_archive_prefix(url, first_level_domain):
+def get_latest_revision_batch(article_urls, fetcher):
     """
-    Removes the archive.org prefix from a URL and returns the modified URL and
-    its first-level domain.
+    Retrieves the current revision ID of several Wikipedia articles with a
+    single multi-title query.
 
     Args:
-        url (str): The original URL with or without the archive.org prefix.
-        first_level_domain (str): The first-level domain of the URL.
+        article_urls (list): Up to MAX_TITLES_PER_QUERY Wikipedia article URLs.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
 
     Returns:
-        tuple: A tuple containing the modified URL and its first-level domain.
+        dict: A mapping of article URL to its latest revision ID. Articles that
+              do not exist are left out.
     """
-    pattern = r'^https://web\.archive\.org/web/(\d{14})/'
-    match = re.match(pattern, url)
+    titles = {article_url_to_title(url): url for url in article_urls}
+    api_url = "https://en.wikipedia.org/w/api.php"
+    params = {
+        "action": "query",
+        "format": "json",
+        "prop": "info",
+        "titles": "|".join(titles),
+        "maxlag": 5
+    }
+
+    data = fetcher.get_json(api_url, params=params)
+    for entry in data["query"].get("normalized", []):
+        if entry["from"] in titles:
+            titles[entry["to"]] = titles[entry["from"]]
+
+    revisions = {}
+    for page in data["query"]["pages"].values():
+        article_url = titles.get(page.get("title"))
+        if article_url is not None and "lastrevid" in page:
+            revisions[article_url] = page["lastrevid"]
 
-    if match:
-        url = re.sub(pattern, '', url)
-        first_level_domain = get_fld(url, fail_silently=True)
-        # For IP address-based URLs
-        if first_level_domain is None:
-            first_level_domain = urlparse(url).hostname
-        return url, first_level_domain
-    else:
-        return url, first_level_domain
+    return revisions
 
-def process_wikipedia_urls(article_urls, connection):
+def get_latest_revisions(article_urls, fetcher):
     """
-    Processes a list of Wikipedia article URLs, extracting external links and
-    their domains, then storing them in a MySQL database.
+    Retrieves the current revision IDs of a list of Wikipedia articles in
+    batches of MAX_TITLES_PER_QUERY titles.
 
     Args:
         article_urls (list): A list of Wikipedia article URLs.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
+
+    Returns:
+        dict: A mapping of article URL to its latest revision ID.
+    """
+    article_urls = list(article_urls)
+    batches = (
+        article_urls[i:i + MAX_TITLES_PER_QUERY]
+        for i in range(0, len(article_urls), MAX_TITLES_PER_QUERY)
+    )
+    revisions = {}
+    for result in fetcher.imap_unordered(
+        lambda batch: get_latest_revision_batch(batch, fetcher), batches
+    ):
+        revisions.update(result)
+    return revisions
+
+def split_unchanged_articles(connection, article_urls, revisions):
+    """
+    Compares current revision IDs against those recorded in the article_state
+    table at the last crawl.
+
+    Args:
         connection (pymysql.connections.Connection): A pymysql connection object.
+        article_urls (list): The Wikipedia article URLs of the run.
+        revisions (dict): A mapping of article URL to its latest revision ID.
+
+    Returns:
+        tuple: A list of article URLs whose revision changed (or that were
+               never crawled) and a list of those that are unchanged, both in
+               the order of article_urls so that the batches built from them
+               (and their recorded requests) are the same on every run.
+               Articles without a revision ID are left out.
     """
-    now = int(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT article_url, last_revid FROM article_state")
+        known = {row["article_url"]: row["last_revid"] for row in cursor.fetchall()}
+
+    changed, unchanged = [], []
     for article_url in article_urls:
-        for url, first_level_domain in get_external_links_and_domains(article_url):
-            with connection.cursor() as cursor:
-                # Check if the First Level Domain exists in the domains table
-                cursor.execute(
-                    "SELECT id FROM domains WHERE domain = %s",
-                    (first_level_domain,)
-                )
-                try:
-                    domain_id = cursor.fetchone()["id"]
-                except:
-                    domain_id = None
-
-                if domain_id is None:
-                    # If not found, insert the First Level Domain into the domains table
-                    cursor.execute(
-                        "INSERT INTO domains (domain) VALUES (%s)",
-                        (first_level_domain,)
-                    )
-                    connection.commit()
-                    domain_id = cursor.lastrowid
-
-                # Insert a row into the urls table or update it if it already exists
-                cursor.execute(
-                    "INSERT INTO urls (url, url_appeared_on, domain_id, last_updated) VALUES (%s, %s, %s, %s)"
-                    " ON DUPLICATE KEY UPDATE last_updated = VALUES(last_updated)",
-                    (url, article_url, domain_id, now)
-                )
-                connection.commit()
-
-def go():
+        if article_url not in revisions:
+            continue
+        if known.get(article_url) == revisions[article_url]:
+            unchanged.append(article_url)
+        else:
+            changed.append(article_url)
+    return changed, unchanged
+
+def carry_forward_unchanged(connection, article_urls, run_id, now):
     """
-    Fetches relevant vaccine-safety articles, processes their external links
-    and stores them in a MySQL database.
+    Restamps the urls rows of articles that have not been edited since their
+    last crawl with the current run's timestamp, without refetching them.
+    Only rows seen at that last crawl are carried forward. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        article_urls (list): URLs of articles whose revision is unchanged.
+        run_id (int): The ID of the current run.
+        now (int): The timestamp of the current run.
     """
-    article_urls = get_list.get_vsafe_set()
+    if not article_urls:
+        return
 
-    connection = pymysql.connect(
-        host=hostname,
-        user=username,
-        password=password,
-        db=dbname,
-        cursorclass=pymysql.cursors.DictCursor
-    )
+    placeholders = ", ".join(["%s"] * len(article_urls))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE urls SET last_updated = %s, run_id = %s"
+            f" WHERE url_appeared_on_hash IN ({placeholders})"
+            " AND last_updated = (SELECT a.last_updated FROM article_state a"
+            " WHERE a.article_url = urls.url_appeared_on)",
+            (now, run_id, *(url_hash(article_url) for article_url in article_urls))
+        )
+        cursor.execute(
+            "UPDATE article_state SET last_updated = %s"
+            f" WHERE article_url IN ({placeholders})",
+            (now, *article_urls)
+        )
+
+def save_article_revisions(connection, revisions, now):
+    """
+    Records the revision ID each article was crawled at. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        revisions (dict): A mapping of article URL to the crawled revision ID.
+        now (int): The timestamp of the current run.
+    """
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            get_storage().upsert_query(
+                "article_state",
+                ("article_url", "last_revid", "last_updated"),
+                ("article_url",),
+                ("last_revid", "last_updated")
+            ),
+            [(article_url, revid, now) for article_url, revid in revisions.items()]
+        )
+
+def load_domain_ids(connection):
+    """
+    Loads the whole domains table into memory.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+
+    Returns:
+        dict: A mapping of lowercased domain to its ID.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, domain FROM domains")
+        return {row["domain"].lower(): row["id"] for row in cursor.fetchall()}
 
+def add_missing_domains(connection, domain_ids, domains):
+    """
+    Inserts the domains that are not in the cache yet with one bulk INSERT and
+    merges their new IDs back into the cache. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        domain_ids (dict): The cache returned by load_domain_ids, updated in place.
+        domains (iterable): Domains about to be referenced.
+    """
+    missing = {domain.lower() for domain in domains} - domain_ids.keys()
+    if not missing:
+        return
+
+    missing = sorted(missing)
+    placeholders = ", ".join(["%s"] * len(missing))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            get_storage().insert_ignore_query("domains", ("domain",)),
+            [(domain,) for domain in missing]
+        )
+        cursor.execute(
+            f"SELECT id, domain FROM domains WHERE domain IN ({placeholders})",
+            missing
+        )
+        for row in cursor.fetchall():
+            domain_ids[row["domain"].lower()] = row["id"]
+
+def get_domain_id(domain_ids, domain):
+    """
+    Looks up a domain in the cache.
+
+    Args:
+        domain_ids (dict): The cache returned by load_domain_ids.
+        domain (str): The domain to look up.
+
+    Returns:
+        int: The ID of the domain.
+
+    Raises:
+        LookupError: If the domain has not been added to the cache.
+    """
     try:
-        process_wikipedia_urls(article_urls, connection)
-    finally:
-        connection.close()
+        return domain_ids[domain.lower()]
+    except KeyError:
+        raise LookupError(f"Domain {domain!r} is not in the domains table") from None
+
+class UrlWriter:
+    """
+    Write-behind buffer for urls rows. Rows are accumulated and flushed as
+    multi-row upserts of at most chunk_size rows; committing is left to the
+    caller so a whole run (or article batch) lands in one transaction.
+    """
+
+    def __init__(self, connection, chunk_size=URL_CHUNK_SIZE):
+        """
+        Args:
+            connection (pymysql.connections.Connection): A pymysql connection object.
+            chunk_size (int, optional): Maximum number of rows per upsert.
+        """
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.written = 0
+
+    def add(self, url, url_appeared_on, domain_id, last_updated, run_id):
+        """
+        Queues a urls row, flushing the buffer once it holds chunk_size rows.
+
+        Args:
+            url (str): The external link.
+            url_appeared_on (str): The URL of the article the link appears on.
+            domain_id (int): The ID of the link's domain.
+            last_updated (int): The timestamp of the current run.
+            run_id (int): The ID of the current run.
+        """
+        self.rows.append((
+            url, url_appeared_on, url_hash(url), url_hash(url_appeared_on),
+            domain_id, last_updated, run_id
+        ))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends all queued rows to the database. Does not commit.
+        """
+        if not self.rows:
+            return
+        with self.connection.cursor() as cursor:
+            # pymysql turns this into a single multi-row INSERT, and sqlite3
+            # reuses one prepared statement
+            cursor.executemany(
+                get_storage().upsert_query(
+                    "urls",
+                    ("url", "url_appeared_on", "url_hash", "url_appeared_on_hash",
+                     "domain_id", "last_updated", "run_id"),
+                    ("url_hash", "url_appeared_on_hash"),
+                    ("last_updated", "run_id")
+                ),
+                self.rows
+            )
+        self.written += len(self.rows)
+        self.rows = []
+
+def forget_article_revisions(connection, article_urls):
+    """
+    Drops the recorded revisions of articles so that the next API crawl
+    refetches them. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        article_urls (list): URLs of the articles to forget.
+    """
+    if not article_urls:
+        return
+
+    placeholders = ", ".join(["%s"] * len(article_urls))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM article_state WHERE article_url IN ({placeholders})",
+            list(article_urls)
+        )
+
+def write_links(connection, domain_ids, writer, links_and_domains, run_id, now):
+    """
+    Resolves the domain IDs of a batch of links, adding new domains in bulk,
+    and queues the links on the writer.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        domain_ids (dict): The cache returned by load_domain_ids.
+        writer (UrlWriter): The buffer to queue urls rows on.
+        links_and_domains (list): Tuples of article URL, link and domain.
+        run_id (int): The ID of the current run.
+        now (int): The timestamp of the current run.
+    """
+    domains = {domain for _, _, domain in links_and_domains}
+    add_missing_domains(connection, domain_ids, domains)
+    instrument.count("links_written", len(links_and_domains))
+    instrument.count("domains_resolved", len(domains))
+
+    for article_url, url, first_level_domain in links_and_domains:
+        writer.add(url, article_url, get_domain_id(domain_ids, first_level_domain), now, run_id)
+
+def start_run(connection, resume=False):
+    """
+    Registers a new crawl run, or picks up the most recent unfinished one.
+    Any other unfinished runs are marked as abandoned.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        resume (bool, optional): Continue the most recent unfinished run
+                                 instead of starting a new one.
+
+    Returns:
+        tuple: The run ID and the run's last_updated timestamp.
+    """
+    with connection.cursor() as cursor:
+        if resume:
+            cursor.execute(
+                "SELECT id, last_updated FROM runs WHERE status = 'running'"
+                " ORDER BY id DESC LIMIT 1"
+            )
+            row = cursor.fetchone()
+            if row:
+                print(f"Resuming run {row['id']}")
+                return row["id"], row["last_updated"]
+
+        cursor.execute("UPDATE runs SET status = 'abandoned' WHERE status = 'running'")
+        now = int(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+        cursor.execute(
+            "INSERT INTO runs (last_updated, status) VALUES (%s, 'running')",
+            (now,)
+        )
+        run_id = cursor.lastrowid
+    connection.commit()
+    print(f"Starting run {run_id}")
+    return run_id, now
+
+def get_finished_articles(connection, run_id):
+    """
+    Retrieves the articles a run has already stored.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run.
+
+    Returns:
+        set: URLs of the finished articles.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT article_url FROM run_articles WHERE run_id = %s",
+            (run_id,)
+        )
+        return {row["article_url"] for row in cursor.fetchall()}
+
+def mark_articles_finished(connection, run_id, article_urls):
+    """
+    Adds articles to a run's checkpoint. Does not commit, so that the
+    checkpoint lands in the same transaction as the articles' links.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run.
+        article_urls (list): URLs of the finished articles.
+    """
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            get_storage().insert_ignore_query("run_articles", ("run_id", "article_url")),
+            [(run_id, article_url) for article_url in article_urls]
+        )
+
+def summarize_domain_usage(connection, run_id):
+    """
+    Writes a run's per-domain link and article counts, along with each
+    domain's status, to the domain_usage table. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM domain_usage WHERE run_id = %s", (run_id,))
+        cursor.execute(
+            "INSERT INTO domain_usage (run_id, domain_id, link_count, article_count, status)"
+            " SELECT u.run_id, u.domain_id, COUNT(*), COUNT(DISTINCT u.url_appeared_on_hash), d.status"
+            " FROM urls u JOIN domains d ON u.domain_id = d.id"
+            " WHERE u.run_id = %s GROUP BY u.run_id, u.domain_id, d.status",
+            (run_id,)
+        )
+
+def summarize_domain_articles(connection, run_id):
+    """
+    Writes the articles linking to each domain that the report and the
+    alerts list (flagged domains and frequently used unrated ones) to the
+    domain_articles table, replacing those of earlier runs. Later runs restamp
+    urls rows before they complete, so this is the only place the articles
+    of the current snapshot can be read from. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run, already summarized in domain_usage.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM domain_articles WHERE run_id <= %s", (run_id,))
+        cursor.execute(
+            "INSERT INTO domain_articles (run_id, domain_id, url_appeared_on, url_appeared_on_hash)"
+            " SELECT DISTINCT du.run_id, du.domain_id, u.url_appeared_on, u.url_appeared_on_hash"
+            " FROM domain_usage du"
+            " JOIN urls u ON u.run_id = du.run_id AND u.domain_id = du.domain_id"
+            f" WHERE du.run_id = %s AND {listed_domain_condition('du')}",
+            (run_id,)
+        )
+
+def record_run_metrics(connection, run_id, article_count):
+    """
+    Appends a run's dashboard metrics, computed from its domain_usage
+    summary, to the run_metrics time series: link and domain totals and
+    their split over the status buckets. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run.
+        article_count (int): Number of articles in the run.
+    """
+    columns = ["run_id", "article_count", "domain_count", "link_count"]
+    expressions = ["%s", "%s", "COUNT(*)", "COALESCE(SUM(link_count), 0)"]
+    for bucket in status_buckets:
+        condition = status_condition(bucket)
+        columns += [f"{bucket}_links", f"{bucket}_domains"]
+        expressions += [
+            f"COALESCE(SUM(CASE WHEN {condition} THEN link_count ELSE 0 END), 0)",
+            f"COALESCE(SUM(CASE WHEN {condition} THEN 1 ELSE 0 END), 0)",
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM run_metrics WHERE run_id = %s", (run_id,))
+        cursor.execute(
+            f"INSERT INTO run_metrics ({', '.join(columns)})"
+            f" SELECT {', '.join(expressions)} FROM domain_usage WHERE run_id = %s",
+            (run_id, article_count, run_id)
+        )
+
+def complete_run(connection, run_id):
+    """
+    Publishes a run as the current snapshot, recording its finish time and
+    article and link counts along with its domain_usage summary, the
+    articles listed for its flagged and frequent domains, and its
+    run_metrics entry, and drops its checkpoint. Does not commit.
+
+    Args:
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        run_id (int): The ID of the run.
+    """
+    finished = int(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(DISTINCT url_appeared_on_hash) AS article_count, COUNT(*) AS link_count"
+            " FROM urls WHERE run_id = %s",
+            (run_id,)
+        )
+        counts = cursor.fetchone()
+        cursor.execute(
+            "UPDATE runs SET status = 'complete', finished = %s,"
+            " article_count = %s, link_count = %s WHERE id = %s",
+            (finished, counts["article_count"], counts["link_count"], run_id)
+        )
+        cursor.execute("DELETE FROM run_articles WHERE run_id = %s", (run_id,))
+    summarize_domain_usage(connection, run_id)
+    summarize_domain_articles(connection, run_id)
+    record_run_metrics(connection, run_id, counts["article_count"])
+
+def process_wikipedia_urls(article_urls, connection, fetcher, resume=False):
+    """
+    Processes a list of Wikipedia article URLs, extracting external links and
+    their domains, then storing them in a MySQL database. Database writes
+    happen on the calling thread while the fetcher's workers keep requesting
+    further batches.
+
+    Only articles edited since their last crawl are refetched; the links of
+    the others are carried forward to this run.
+
+    Each article batch is committed together with the run's checkpoint, so an
+    interrupted run can be resumed where it stopped. The run only becomes the
+    current snapshot once every article has been stored.
+
+    Args:
+        article_urls (list): A list of Wikipedia article URLs.
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        fetcher (fetch.Fetcher): Fetcher to issue API requests with.
+        resume (bool, optional): Continue the most recent unfinished run.
+    """
+    run_id, now = start_run(connection, resume)
+    finished = get_finished_articles(connection, run_id)
+    article_urls = [url for url in article_urls if url not in finished]
+    if finished:
+        print(f"{len(finished)} articles already finished in this run")
+
+    revisions = get_latest_revisions(article_urls, fetcher)
+    changed, unchanged = split_unchanged_articles(connection, article_urls, revisions)
+    print(f"{len(changed)} articles changed, {len(unchanged)} unchanged since last crawl")
+
+    domain_ids = load_domain_ids(connection)
+    writer = UrlWriter(connection)
+
+    try:
+        carry_forward_unchanged(connection, unchanged, run_id, now)
+        mark_articles_finished(connection, run_id, unchanged)
+        connection.commit()
+
+        for batch, links_and_domains in get_external_link_batches(changed, fetcher):
+            write_links(connection, domain_ids, writer, links_and_domains, run_id, now)
+            writer.flush()
+            save_article_revisions(connection, {url: revisions[url] for url in batch}, now)
+            mark_articles_finished(connection, run_id, batch)
+            connection.commit()
+
+        complete_run(connection, run_id)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    print(f"{writer.written} links written")
+
+def process_dump(article_urls, connection, page_dump, externallinks_dump):
+    """
+    Ingests the external links of a list of Wikipedia articles from local
+    page and externallinks SQL dumps instead of the API. Both dumps are
+    streamed and the whole run is committed as one transaction.
+
+    Args:
+        article_urls (list): A list of Wikipedia article URLs.
+        connection (pymysql.connections.Connection): A pymysql connection object.
+        page_dump (str): Path to the gzipped page table dump.
+        externallinks_dump (str): Path to the gzipped externallinks table dump.
+    """
+    run_id, now = start_run(connection)
+
+    titles = {
+        article_url_to_title(url).replace(" ", "_"): url for url in article_urls
+    }
+    page_ids = dumps.load_page_ids(page_dump, set(titles))
+    print(f"{len(page_ids)} of {len(titles)} articles found in the page dump")
+
+    domain_ids = load_domain_ids(connection)
+    writer = UrlWriter(connection)
+
+    def write_chunk(chunk):
+        links = urls_to_domains(link for _, link in chunk)
+        links_and_domains = [
+            (titles[title], link, domain)
+            for (title, _), (link, domain) in zip(chunk, links)
+            if domain
+        ]
+        write_links(connection, domain_ids, writer, links_and_domains, run_id, now)
+
+    try:
+        chunk = []
+        for title, link in dumps.iter_external_links(externallinks_dump, page_ids):
+            chunk.append((title, link))
+            if len(chunk) >= URL_CHUNK_SIZE:
+                write_chunk(chunk)
+                chunk = []
+        write_chunk(chunk)
+
+        writer.flush()
+        # The dump carries no revision IDs, so make the next API crawl
+        # refetch these articles rather than carry forward stale rows
+        forget_article_revisions(connection, list(titles.values()))
+        complete_run(connection, run_id)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    print(f"{writer.written} links written")
+
+def record_crawl_rates(before, seconds):
+    """
+    Records the crawl throughput as gauges, from the links and domains counted
+    by write_links during the crawl.
+
+    Args:
+        before (dict): The counters as they were when the crawl started.
+        seconds (float): Wall time of the crawl.
+    """
+    after = instrument.summary()["counters"]
+    seconds = max(seconds, 1e-9)
+    for name, rate in (("links_written", "links_per_second"),
+                       ("domains_resolved", "domains_per_second")):
+        instrument.gauge(rate, (after.get(name, 0) - before.get(name, 0)) / seconds)
+    instrument.gauge("crawl_seconds", seconds)
+
+def go(workers=FETCH_WORKERS, requests_per_second=REQUESTS_PER_SECOND,
+       page_dump=None, externallinks_dump=None, resume=False, session=None):
+    """
+    Fetches relevant vaccine-safety articles, processes their external links
+    and stores them in the references database.
+
+    Args:
+        workers (int, optional): Number of concurrent API requests.
+        requests_per_second (float, optional): Global API request rate limit.
+        page_dump (str, optional): Path to a gzipped page table dump. If given
+                                   together with externallinks_dump, links are
+                                   read from the dumps instead of the API.
+        externallinks_dump (str, optional): Path to a gzipped externallinks
+                                            table dump.
+        resume (bool, optional): Continue the most recent interrupted crawl
+                                 instead of starting over.
+        session (db.Session, optional): Database session shared with the
+                                        other bot stages.
+    """
+    from pageset import get_list
+
+    # Sorted, so that the API batches are the same on every run
+    article_urls = sorted(get_list.get_vsafe_set())
+
+    before = instrument.summary()["counters"]
+    start = time.perf_counter()
+    with stage_connection(session, "check_references",
+                          dict_rows=True) as connection:
+        if page_dump and externallinks_dump:
+            process_dump(article_urls, connection, page_dump, externallinks_dump)
+        else:
+            fetcher = Fetcher(workers=workers, requests_per_second=requests_per_second)
+            try:
+                process_wikipedia_urls(article_urls, connection, fetcher, resume)
+            finally:
+                fetcher.close()
+    record_crawl_rates(before, time.perf_counter() - start)
 
 if __name__ == "__main__":
-    go()
+    parser = argparse.ArgumentParser(description="Refresh the references database")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS,
+                        help="number of concurrent API requests")
+    parser.add_argument("--requests-per-second", type=float, default=REQUESTS_PER_SECOND,
+                        help="global API request rate limit")
+    parser.add_argument("--page-dump", help="gzipped page table SQL dump")
+    parser.add_argument("--externallinks-dump", help="gzipped externallinks table SQL dump")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the most recent interrupted crawl")
+    args = parser.parse_args()
+
+    if bool(args.page_dump) != bool(args.externallinks_dump):
+        parser.error("--page-dump and --externallinks-dump must be given together")
+
+    go(args.workers, args.requests_per_second, args.page_dump,
+       args.externallinks_dump, args.resume)
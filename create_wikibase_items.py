@@ -2,93 +2,78 @@
 Creates new items on the Domains Wikibase based on new domains
 from the check-references workflow
 """
-import requests
-from wikidataintegrator import wdi_core, wdi_login
-from credentials import wikibase_username, wikibase_password
+import resources
 from db import *
 
-# Set up SPARQL query
-sparql_endpoint = "https://domains.wikibase.cloud/query/sparql"
-query = """
-PREFIX wdt: <https://domains.wikibase.cloud/prop/direct/>
-PREFIX wd: <https://domains.wikibase.cloud/entity/>
-
-SELECT ?item ?P1_value
-WHERE {
-  ?item wdt:P1 ?P1_value .
-}
-"""
-response = requests.get(sparql_endpoint, params={'query': query, 'format': 'json'})
-results = response.json()
-
-# Get existing domain mapping
-existing_domains = {
-    result['P1_value']['value']: result['item']['value']
-    for result in results['results']['bindings']
-}
+# Status mapping
+status_mapping = {1: "Q2", 2: "Q3", 3: "Q4", 4: "Q5", 5: "Q6", 6: "Q7"}
 
-# Set up MySQL connection
-connection = create_conn()
-cursor = connection.cursor()
+def create_item(domain, status, perennial_source):
+    """
+    Creates the Wikibase item of a domain.
 
-# Query MySQL table
-query = "SELECT domain, status, perennial_source FROM domains"
-cursor.execute(query)
+    Args:
+        domain (str): The domain.
+        status (int): The domain's status, or None.
+        perennial_source (int): 1 if the domain is a perennial source.
+    """
+    from wikidataintegrator import wdi_core
 
-# Status mapping
-status_mapping = {1: "Q2", 2: "Q3", 3: "Q4", 4: "Q5", 5: "Q6", 6: "Q7"}
+    item_data = [
+        wdi_core.WDString(value=domain, prop_nr="P1"),
+    ]
 
-for row in cursor:
-    domain, status, perennial_source = row
+    qualifiers = {}
+    if status is not None and status > 0:
+        qualifiers["P8"] = status_mapping.get(status)
 
-    # Check if domain is already in Wikibase
-    if domain not in existing_domains:
-        # Create new Wikibase item
-        item_data = [
-            wdi_core.WDString(value=domain, prop_nr="P1"),
+    if perennial_source == 1:
+        qualifiers_list = [
+            wdi_core.WDItemID(
+                prop_nr=prop_nr, value=value, is_qualifier=True
+            ) for prop_nr, value in qualifiers.items()
         ]
+        item_data.append(wdi_core.WDUrl(
+            value="https://en.wikipedia.org/wiki/Wikipedia:Vaccine_safety/Perennial_sources",
+            prop_nr="P7",
+            qualifiers=qualifiers_list
+        ))
+
+    # Save new Wikibase item and print ID
+    new_item = wdi_core.WDItemEngine(
+        data=item_data,
+        mediawiki_api_url=resources.wikibase_api_url,
+        sparql_endpoint_url=resources.wikibase_sparql_endpoint
+    )
+    new_item.set_label(domain, lang="en")  # Set label to P1 value
+    new_item.set_description("domain", lang="en")  # Set description to "domain"
 
-        qualifiers = {}
-        if status is not None and status > 0:
-            qualifiers["P8"] = status_mapping.get(status)
+    try:
+        new_item.write(resources.get("wikibase_login"))
+        print(f"Created new Wikibase item with ID: {new_item.wd_item_id}")
+    # If a non-unique label and description pair occurs in this context, it
+    # means the item has already been created and we can safely skip over it.
+    except wdi_core.NonUniqueLabelDescriptionPairError:
+        pass
 
-        if perennial_source == 1:
-            qualifiers_list = [
-                wdi_core.WDItemID(
-                    prop_nr=prop_nr, value=value, is_qualifier=True
-                ) for prop_nr, value in qualifiers.items()
-            ]
-            item_data.append(wdi_core.WDUrl(
-                value="https://en.wikipedia.org/wiki/Wikipedia:Vaccine_safety/Perennial_sources",
-                prop_nr="P7",
-                qualifiers=qualifiers_list
-            ))
+def main():
+    """
+    Creates a Wikibase item for every domain of the references database
+    that is not on the Domains Wikibase yet.
+    """
+    # Get existing domain mapping
+    existing_domains = resources.get("wikibase_domains")
 
-        # Save new Wikibase item and print ID
-        new_item = wdi_core.WDItemEngine(
-            data=item_data,
-            mediawiki_api_url="https://domains.wikibase.cloud/w/api.php",
-            sparql_endpoint_url="https://domains.wikibase.cloud/query/sparql"
-        )
-        new_item.set_label(domain, lang="en")  # Set label to P1 value
-        new_item.set_description("domain", lang="en")  # Set description to "domain"
+    with stage_connection(None, "create_wikibase_items") as connection:
+        rows = execute_query(connection, "SELECT domain, status, perennial_source FROM domains")
 
-        # Set up WikidataIntegrator login
-        login_instance = wdi_login.WDLogin(
-            user=wikibase_username,
-            pwd=wikibase_password,
-            mediawiki_api_url="https://domains.wikibase.cloud/w/api.php",
-            mediawiki_index_url="https://domain.wikibase.cloud/w/index.php",
-            user_agent="Vsafe-Data/1.0 (james@scatter.red)"
-        )
-        try:
-            new_item.write(login_instance)
-            print(f"Created new Wikibase item with ID: {new_item.wd_item_id}")
-        # If a non-unique label and description pair occurs in this context, it
-        # means the item has already been created and we can safely skip over it.
-        except wdi_core.NonUniqueLabelDescriptionPairError:
-            continue
+    try:
+        for domain, status, perennial_source in rows:
+            # Check if domain is already in Wikibase
+            if domain not in existing_domains:
+                create_item(domain, status, perennial_source)
+    finally:
+        resources.close()
 
-# Close MySQL connection
-cursor.close()
-connection.close()
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,205 @@
-from credentials import hostname, dbname, username, password
-import pymysql
+from contextlib import contextmanager
+import hashlib
+import queue
+import threading
+import instrument
+from storage import get_storage
 
 def create_conn():
     """
-    Connect to the MySQL database using the credentials provided.
+    Connect to the database of the configured storage backend (MySQL using
+    the credentials provided, or SQLite).
 
     Returns:
         pymysql.connections.Connection: Connection object if successful, None otherwise.
     """
     try:
-        connection = pymysql.connect(user=username,
-                                     password=password,
-                                     host=hostname,
-                                     database=dbname)
+        return instrument.InstrumentedConnection(get_storage().connect())
+    except Exception as e:
+        print(f"Error while connecting to the database: {e}")
+        return None
+
+class ConnectionPool:
+    """
+    Keeps idle database connections around for reuse. Connections are pinged on
+    checkout, so ones the server dropped during a long crawl are reopened
+    instead of failing with a stale handle.
+    """
+
+    def __init__(self, size=4):
+        """
+        Args:
+            size (int, optional): Maximum number of connections checked out at
+                                  the same time.
+        """
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        """
+        Opens a new connection to the configured storage backend.
+
+        Returns:
+            pymysql.connections.Connection: The new connection.
+        """
+        return instrument.InstrumentedConnection(get_storage().connect())
+
+    def acquire(self):
+        """
+        Checks out a connection, reusing an idle one when available. Blocks
+        while the pool is exhausted.
+
+        Returns:
+            pymysql.connections.Connection: A live connection.
+        """
+        self.slots.acquire()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = None
+
+        try:
+            if connection is None:
+                connection = self.connect()
+            else:
+                get_storage().ping(connection)
+        except BaseException:
+            self.slots.release()
+            raise
         return connection
-    except pymysql.Error as e:
-        print(f"Error while connecting to MySQL: {e}")
+
+    def release(self, connection):
+        """
+        Returns a checked out connection to the pool.
+
+        Args:
+            connection (pymysql.connections.Connection): The connection.
+        """
+        if connection.open:
+            self.idle.put(connection)
+        self.slots.release()
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            if connection.open:
+                connection.close()
+
+class Session:
+    """
+    A database session shared by all stages of one bot run. Each stage checks
+    out a pooled connection configured for its needs.
+
+    Usage:
+        with Session() as session:
+            with session.stage("reports", consistent_snapshot=True) as connection:
+                ...
+    """
+
+    def __init__(self, pool=None, pool_size=4):
+        """
+        Args:
+            pool (ConnectionPool, optional): Pool to draw connections from. A
+                                             private pool is created if omitted.
+            pool_size (int, optional): Size of the private pool.
+        """
+        self.owns_pool = pool is None
+        self.pool = pool or ConnectionPool(pool_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the session's pool if the session created it.
+        """
+        if self.owns_pool:
+            self.pool.close()
+
+    @contextmanager
+    def stage(self, name, autocommit=False, consistent_snapshot=False,
+              dict_rows=False):
+        """
+        Checks out a connection for one stage of the run. Unless autocommit is
+        enabled, the stage's work is committed when the block exits normally
+        and rolled back if it raises.
+
+        Args:
+            name (str): Name of the stage, for diagnostics.
+            autocommit (bool, optional): Commit every statement immediately.
+            consistent_snapshot (bool, optional): Read from one consistent
+                                                  snapshot for the whole stage.
+            dict_rows (bool, optional): Have cursors return rows as dicts
+                                        rather than tuples.
+
+        Yields:
+            pymysql.connections.Connection: The configured connection.
+        """
+        storage = get_storage()
+        connection = self.pool.acquire()
+        try:
+            storage.set_dict_rows(connection, dict_rows)
+            storage.set_autocommit(connection, autocommit)
+            if consistent_snapshot:
+                storage.begin_snapshot(connection)
+
+            try:
+                yield connection
+            except BaseException:
+                print(f"Rolling back {name} stage")
+                connection.rollback()
+                raise
+            if not autocommit:
+                connection.commit()
+        finally:
+            storage.set_dict_rows(connection, False)
+            self.pool.release(connection)
+
+@contextmanager
+def stage_connection(session, name, **options):
+    """
+    Checks out a connection for a stage from a shared session, or from a
+    private one-connection session when the stage is run on its own.
+
+    Args:
+        session (Session): The shared session, or None.
+        name (str): Name of the stage.
+        **options: Stage options accepted by Session.stage.
+
+    Yields:
+        pymysql.connections.Connection: The configured connection.
+    """
+    if session is not None:
+        with session.stage(name, **options) as connection:
+            yield connection
+    else:
+        with Session(pool_size=1) as private_session:
+            with private_session.stage(name, **options) as connection:
+                yield connection
+
+def url_hash(url):
+    """
+    Computes the fixed-width key the urls table stores for a URL. Matches
+    UNHEX(MD5(url)) computed by MySQL on a utf8mb4 column.
+
+    Args:
+        url (str): The URL, or None.
+
+    Returns:
+        bytes: The 16-byte MD5 digest of the URL, or None.
+    """
+    if url is None:
         return None
+    return hashlib.md5(url.encode("utf-8")).digest()
 
 def execute_scalar(connection, query, params=None):
     """
@@ -97,9 +280,47 @@ def update_column(connection, table, column, value, conditions):
     connection.commit()
     cursor.close()
 
+def bulk_update_column(connection, table, column, value, key_columns, key_rows,
+                       chunk_size=1000):
+    """
+    Sets a column to a value on every row matching one of many keys, using
+    one UPDATE ... WHERE (a, b) IN ((...), (...)) statement per chunk of keys.
+    Does not commit, so the updates join the caller's transaction.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+        table (str): Table name to update.
+        column (str): Column name to update.
+        value (Any): New value for the column.
+        key_columns (Sequence[str]): Columns identifying the rows to update.
+        key_rows (Sequence[Tuple]): Key values, one tuple per row, in the
+                                    order of key_columns.
+        chunk_size (int, optional): Maximum number of keys per statement.
+
+    Returns:
+        int: Number of rows affected.
+    """
+    key_rows = list(dict.fromkeys(tuple(row) for row in key_rows))
+    affected = 0
+
+    cursor = connection.cursor()
+    for i in range(0, len(key_rows), chunk_size):
+        chunk = key_rows[i:i + chunk_size]
+        query = f"""
+            UPDATE {table}
+            SET {column} = %s
+            WHERE {get_storage().row_in_clause(key_columns, len(chunk))};
+        """
+        affected += cursor.execute(query, (value, *(val for row in chunk for val in row)))
+
+    cursor.close()
+    return affected
+
 def update_column_with_conditions(connection, table, column, value, conditions_list):
     """
     Updates a column in a table with a specified value for multiple sets of conditions.
+    Condition sets on the same columns are applied together by bulk_update_column,
+    and all of them are committed at the end.
 
     Args:
         connection (pymysql.connections.Connection): Database connection.
@@ -108,17 +329,40 @@ def update_column_with_conditions(connection, table, column, value, conditions_l
         value (Any): New value for the column.
         conditions_list (List[Tuple]): List of tuples containing conditions to
                                        be applied in the WHERE clause.
-    """
-    cursor = connection.cursor()
 
+    Returns:
+        int: Number of rows affected.
+    """
+    groups = {}
     for conditions in conditions_list:
-        where_clause = " AND ".join([f"{col} = %s" for col, _ in conditions])
-        query = f"""
-            UPDATE {table}
-            SET {column} = {value}
-            WHERE {where_clause};
-        """
-        cursor.execute(query, tuple(val for _, val in conditions))
+        key_columns = tuple(col for col, _ in conditions)
+        groups.setdefault(key_columns, []).append(tuple(val for _, val in conditions))
 
+    affected = sum(
+        bulk_update_column(connection, table, column, value, key_columns, key_rows)
+        for key_columns, key_rows in groups.items()
+    )
     connection.commit()
-    cursor.close()
+    return affected
+
+def get_current_run(connection):
+    """
+    Retrieves the ID of the most recent completed crawl run, the current
+    snapshot. The snapshot is read from the run's rows in domain_usage,
+    domain_articles and run_metrics, written when it completed, never from
+    urls: a later, unfinished run restamps urls rows and adds new ones.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+
+    Returns:
+        int: The ID of the run.
+
+    Raises:
+        LookupError: If no crawl run has completed yet.
+    """
+    query = "SELECT MAX(id) FROM runs WHERE status = 'complete'"
+    run_id = execute_scalar(connection, query)
+    if run_id is None:
+        raise LookupError("No completed crawl run found")
+    return run_id
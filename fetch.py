@@ -0,0 +1,156 @@
+"""
+Concurrent, rate-limited HTTP fetching for API crawls.
+
+A Fetcher owns a pooled keep-alive session, a worker pool and a global
+requests-per-second limiter shared by all workers. Failed requests (HTTP 429,
+5xx and MediaWiki "maxlag" errors) are retried with exponential backoff.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+import transport
+
+USER_AGENT = "Vsafe-Data/1.0 (james@scatter.red)"
+
+class RateLimiter:
+    """
+    Spaces out calls so that no more than a given number happen per second,
+    across all threads.
+    """
+
+    def __init__(self, requests_per_second):
+        """
+        Args:
+            requests_per_second (float): Maximum sustained request rate. A
+                                         value of 0 or None disables limiting.
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        """
+        Blocks until the caller is allowed to make its next request.
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_for = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+class Fetcher:
+    """
+    Fetches JSON documents through a shared session using a pool of workers.
+    """
+
+    def __init__(self, workers=4, requests_per_second=5, max_retries=5,
+                 backoff=1.0, timeout=60):
+        """
+        Args:
+            workers (int): Number of concurrent worker threads.
+            requests_per_second (float): Global request rate limit.
+            max_retries (int): Attempts after the first before giving up.
+            backoff (float): Initial backoff in seconds, doubled per retry.
+            timeout (float): Per-request timeout in seconds.
+        """
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(requests_per_second)
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def get_json(self, url, params=None):
+        """
+        Performs a rate-limited GET request and decodes the JSON response,
+        retrying on throttling, server errors and maxlag.
+
+        Args:
+            url (str): URL to request.
+            params (dict, optional): Query string parameters.
+
+        Returns:
+            dict: The decoded JSON response.
+
+        Raises:
+            requests.HTTPError: If the request still fails after all retries.
+        """
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = transport.get(
+                url, params=params, session=self.session, timeout=self.timeout
+            )
+            retry_after = response.headers.get("Retry-After")
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+            else:
+                response.raise_for_status()
+                data = response.json()
+                error = data.get("error") if isinstance(data, dict) else None
+                if not error or error.get("code") != "maxlag":
+                    return data
+                if attempt == self.max_retries:
+                    raise requests.HTTPError(f"maxlag persisted: {error.get('info')}")
+
+            wait_for = delay
+            if retry_after and retry_after.isdigit():
+                wait_for = max(wait_for, int(retry_after))
+            time.sleep(wait_for)
+            delay *= 2
+
+    def imap_unordered(self, func, items):
+        """
+        Applies func to every item on the worker pool and yields the results
+        as they complete. At most twice as many items as there are workers are
+        in flight at once, so the caller can consume results (e.g. write them
+        to the database) while further requests are running.
+
+        Args:
+            func (callable): Function to call with each item.
+            items (iterable): Items to process.
+
+        Yields:
+            Any: The return value of func for each item, in completion order.
+        """
+        items = iter(items)
+        pending = set()
+        window = self.workers * 2
+
+        def fill():
+            while len(pending) < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                pending.add(self.executor.submit(func, item))
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pending.difference_update(done)
+            fill()
+            for future in done:
+                yield future.result()
+
+    def close(self):
+        """
+        Shuts down the worker pool and closes the session.
+        """
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,367 @@
+"""
+Run instrumentation: wall and CPU time per stage, HTTP requests per
+endpoint, database queries per query name, and free-form counters and
+gauges.
+
+Measurements are collected in memory for the whole process and written by
+write() as a JSON run summary and a Prometheus text-format file, both in
+VSAFE_METRICS_DIR (default "metrics"). Stages named in VSAFE_PROFILE (a
+comma-separated list, or "all") are also run under cProfile, and their
+profiles dumped next to the summary as <stage>.prof.
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+metrics_dir = os.environ.get("VSAFE_METRICS_DIR", "metrics")
+profiled_stages = {name.strip() for name in os.environ.get("VSAFE_PROFILE", "").split(",") if name.strip()}
+
+lock = threading.Lock()
+# Held by the stage being profiled: only one profiler can be active in the
+# process, and concurrent stages would show up in each other's profiles
+profile_lock = threading.Lock()
+started = datetime.datetime.now()
+
+# Measurements by stage, endpoint, query name and counter or gauge name
+stages = {}
+http = {}
+queries = {}
+counters = {}
+gauges = {}
+
+statement_pattern = re.compile(
+    r'^\s*(?:(SELECT|DELETE)\b.*?\bFROM\s+`?(\w+)'
+    r'|(INSERT)(?:\s+(?:IGNORE|OR\s+IGNORE))?\s+INTO\s+`?(\w+)'
+    r'|(UPDATE)\s+`?(\w+)'
+    r'|(\w+))',
+    re.IGNORECASE | re.DOTALL
+)
+
+def add(table, key, **values):
+    """
+    Adds values to the totals of one key of a measurement table, and keeps
+    the largest "seconds" seen as "max_seconds".
+
+    Args:
+        table (dict): The measurement table.
+        key (str): The stage, endpoint or query name.
+        **values: Amounts to add.
+    """
+    with lock:
+        totals = table.setdefault(key, {"count": 0})
+        totals["count"] += 1
+        for name, value in values.items():
+            totals[name] = totals.get(name, 0) + value
+        if "seconds" in values:
+            totals["max_seconds"] = max(totals.get("max_seconds", 0), values["seconds"])
+
+@contextmanager
+def stage(name):
+    """
+    Measures the wall and CPU time of a stage of the run, profiling it if it
+    is named in VSAFE_PROFILE. CPU time is that of the calling thread, since
+    independent stages run concurrently. Only one stage is profiled at a
+    time; a stage starting while another is profiled is only timed.
+
+    Args:
+        name (str): Name of the stage.
+    """
+    profiler = None
+    if name in profiled_stages or "all" in profiled_stages:
+        if profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Another profiling tool is active in the process
+                profile_lock.release()
+                print(f"Not profiling {name}: {e}")
+                profiler = None
+        else:
+            print(f"Not profiling {name}: another stage is being profiled")
+
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        add(stages, name,
+            seconds=time.perf_counter() - wall_start,
+            cpu_seconds=time.thread_time() - cpu_start)
+        if profiler is not None:
+            profiler.disable()
+            profile_lock.release()
+            os.makedirs(metrics_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(metrics_dir, f"{name}.prof"))
+
+def record_http(url, seconds, status_code):
+    """
+    Records one HTTP request.
+
+    Args:
+        url (str): Request URL; its host and path name the endpoint.
+        seconds (float): Time until the response arrived.
+        status_code (int): HTTP status of the response.
+    """
+    parts = urlsplit(url)
+    add(http, parts.netloc + parts.path,
+        seconds=seconds,
+        errors=1 if status_code >= 400 else 0)
+
+@lru_cache(maxsize=1024)
+def query_name(query):
+    """
+    Names a query after its statement type and first table, e.g.
+    "select_urls" or "insert_domain_usage".
+
+    Args:
+        query (str): The SQL statement.
+
+    Returns:
+        str: The query name.
+    """
+    match = statement_pattern.match(query)
+    if match is None:
+        return "other"
+    words = [group for group in match.groups() if group]
+    return "_".join(words).lower()
+
+def record_query(query, seconds, rows):
+    """
+    Records one database statement.
+
+    Args:
+        query (str): The SQL statement.
+        seconds (float): Time the statement took to execute.
+        rows (int): Rows affected or returned, if known.
+    """
+    add(queries, query_name(query), seconds=seconds, rows=max(rows, 0))
+
+def add_rows(query, rows):
+    """
+    Adds rows fetched after execution to a query name's total.
+
+    Args:
+        query (str): The SQL statement.
+        rows (int): Number of rows fetched.
+    """
+    with lock:
+        totals = queries.setdefault(query_name(query), {"count": 0})
+        totals["rows"] = totals.get("rows", 0) + rows
+
+def count(name, value=1):
+    """
+    Adds to a counter.
+
+    Args:
+        name (str): Name of the counter.
+        value (int, optional): Amount to add.
+    """
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+def gauge(name, value):
+    """
+    Sets a gauge to its latest value.
+
+    Args:
+        name (str): Name of the gauge.
+        value (float): The value.
+    """
+    with lock:
+        gauges[name] = value
+
+class InstrumentedCursor:
+    """
+    Wraps a database cursor to record every statement it executes. When the
+    driver does not report a row count for a statement (SQLite SELECTs), the
+    rows fetched are counted instead.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.uncounted = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.close()
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def execute(self, query, params=None):
+        start = time.perf_counter()
+        result = self.cursor.execute(query, params)
+        self.record(query, time.perf_counter() - start)
+        return result
+
+    def executemany(self, query, seq_of_params):
+        start = time.perf_counter()
+        result = self.cursor.executemany(query, seq_of_params)
+        self.record(query, time.perf_counter() - start)
+        return result
+
+    def record(self, query, seconds):
+        rows = self.cursor.rowcount
+        self.uncounted = query if rows < 0 else None
+        record_query(query, seconds, rows)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None and self.uncounted is not None:
+            add_rows(self.uncounted, 1)
+        return row
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if self.uncounted is not None:
+            add_rows(self.uncounted, len(rows))
+        return rows
+
+class InstrumentedConnection:
+    """
+    Wraps a database connection so that its cursors record their statements.
+    Every other attribute is read from and written to the wrapped connection.
+    """
+
+    def __init__(self, connection):
+        object.__setattr__(self, "wrapped", connection)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.wrapped, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.wrapped.cursor(*args, **kwargs))
+
+def summary():
+    """
+    Collects every measurement of the run.
+
+    Returns:
+        dict: The run summary.
+    """
+    with lock:
+        return {
+            "started": started.isoformat(timespec="seconds"),
+            "finished": datetime.datetime.now().isoformat(timespec="seconds"),
+            "stages": {name: dict(values) for name, values in stages.items()},
+            "http": {name: dict(values) for name, values in http.items()},
+            "queries": {name: dict(values) for name, values in queries.items()},
+            "counters": dict(counters),
+            "gauges": dict(gauges),
+        }
+
+def escape_label(value):
+    """
+    Escapes a Prometheus label value.
+
+    Args:
+        value (str): The label value.
+
+    Returns:
+        str: The escaped value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def metric_name(name):
+    """
+    Turns a counter or gauge name into a valid Prometheus metric name.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        str: The metric name, prefixed with "vsafe_".
+    """
+    return "vsafe_" + re.sub(r'[^a-zA-Z0-9_]', "_", name)
+
+def to_prometheus(run_summary):
+    """
+    Formats a run summary in the Prometheus text exposition format.
+
+    Args:
+        run_summary (dict): The summary returned by summary().
+
+    Returns:
+        str: The metrics, one sample per line.
+    """
+    # Metric name, help text, summary table, label name and value key
+    table_metrics = [
+        ("vsafe_stage_wall_seconds", "Wall time of each stage", "stages", "stage", "seconds"),
+        ("vsafe_stage_cpu_seconds", "CPU time of each stage", "stages", "stage", "cpu_seconds"),
+        ("vsafe_http_requests_total", "HTTP requests per endpoint", "http", "endpoint", "count"),
+        ("vsafe_http_errors_total", "HTTP error responses per endpoint", "http", "endpoint", "errors"),
+        ("vsafe_http_request_seconds_total", "Time spent in HTTP requests per endpoint", "http", "endpoint", "seconds"),
+        ("vsafe_http_request_max_seconds", "Slowest HTTP request per endpoint", "http", "endpoint", "max_seconds"),
+        ("vsafe_db_queries_total", "Database statements per query name", "queries", "query", "count"),
+        ("vsafe_db_rows_total", "Rows affected or returned per query name", "queries", "query", "rows"),
+        ("vsafe_db_query_seconds_total", "Time spent in database statements per query name", "queries", "query", "seconds"),
+    ]
+
+    lines = []
+    for name, help_text, table, label, key in table_metrics:
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for label_value, values in sorted(run_summary[table].items()):
+            lines.append(f'{name}{{{label}="{escape_label(label_value)}"}} {values.get(key, 0)}')
+
+    for name, value in sorted(run_summary["counters"].items()):
+        lines.append(f"# TYPE {metric_name(name)}_total counter")
+        lines.append(f"{metric_name(name)}_total {value}")
+    for name, value in sorted(run_summary["gauges"].items()):
+        lines.append(f"# TYPE {metric_name(name)} gauge")
+        lines.append(f"{metric_name(name)} {value}")
+    return "\n".join(lines) + "\n"
+
+def write_file(path, content):
+    """
+    Writes a file atomically, so a metrics scraper never reads half of it.
+
+    Args:
+        path (str): Path of the file.
+        content (str): Its contents.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+def write(directory=None):
+    """
+    Writes the run summary as run_summary.json and metrics.prom.
+
+    Args:
+        directory (str, optional): Output directory. Defaults to
+                                   VSAFE_METRICS_DIR.
+
+    Returns:
+        dict: The run summary.
+    """
+    directory = directory or metrics_dir
+    os.makedirs(directory, exist_ok=True)
+    run_summary = summary()
+    write_file(os.path.join(directory, "run_summary.json"), json.dumps(run_summary, indent=1, sort_keys=True))
+    write_file(os.path.join(directory, "metrics.prom"), to_prometheus(run_summary))
+    print(f"Run metrics written to {directory}")
+    return run_summary
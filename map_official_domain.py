@@ -1,6 +1,5 @@
-import requests
-from wikidataintegrator import wdi_core, wdi_login
-from credentials import wikibase_username, wikibase_password
+import resources
+import transport
 
 def wikibase_domains_query():
     """
@@ -20,7 +19,7 @@ def wikibase_domains_query():
     '''
 
     url = 'https://domains.wikibase.cloud/query/sparql'
-    response = requests.get(url, params={'query': query, 'format': 'json'})
+    response = transport.get(url, params={'query': query, 'format': 'json'})
     return response.json()
 
 def fetch_wikidata_official_websites():
@@ -38,7 +37,7 @@ def fetch_wikidata_official_websites():
     '''
 
     url = 'https://sparql.orb.rest/bigdata/namespace/wdq/sparql'
-    response = requests.get(url, params={'query': query, 'format': 'json'})
+    response = transport.get(url, params={'query': query, 'format': 'json'})
     return response.json()
 
 def is_root_domain(official_website, domain):
@@ -63,13 +62,7 @@ def update_wikibase_item(wikibase_item, wikidata_item):
         wikibase_item (str): Domains Wikibase item ID to update.
         wikidata_item (str): Wikidata item ID to associate with the Wikibase item.
     """
-    login_instance = wdi_login.WDLogin(
-        user=wikibase_username,
-        pwd=wikibase_password,
-        mediawiki_api_url="https://domains.wikibase.cloud/w/api.php",
-        mediawiki_index_url="https://domains.wikibase.cloud/w/index.php",
-        user_agent="YourAppName/1.0 (yourname@example.com)"
-    )
+    from wikidataintegrator import wdi_core
 
     item_data = [
         wdi_core.WDString(value=wikidata_item, prop_nr="P2")
@@ -78,11 +71,11 @@ def update_wikibase_item(wikibase_item, wikidata_item):
     item = wdi_core.WDItemEngine(
         wd_item_id=wikibase_item,
         data=item_data,
-        mediawiki_api_url="https://domains.wikibase.cloud/w/api.php",
-        sparql_endpoint_url="https://domains.wikibase.cloud/query/sparql"
+        mediawiki_api_url=resources.wikibase_api_url,
+        sparql_endpoint_url=resources.wikibase_sparql_endpoint
     )
 
-    item.write(login_instance)
+    item.write(resources.get("wikibase_login"))
 
 def main():
     """
@@ -115,5 +108,7 @@ def main():
                 wikidata_item = websites_dict[full_domain]
                 update_wikibase_item(wikibase_item, wikidata_item)
 
+    resources.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,175 @@
+"""
+Applies the numbered schema migrations to the references database,
+recording each applied version in the schema_version table, and checks that
+the report queries are served by indexes.
+
+For MySQL, schema.sql is version 0 and the migrations live in migrations/.
+schema.sql is the original database dump and is never edited: every schema
+change, including the crawl run tables, is a migration, so a database
+imported from the dump is upgraded in place without reimporting it.
+For SQLite, schema_sqlite.sql creates the schema at its current version and
+later migrations live in migrations/sqlite/. Migrations are named
+NNNN_description.sql and are applied in order.
+
+Usage:
+    python3 migrate.py            apply pending migrations
+    python3 migrate.py --check    EXPLAIN the report and alerts queries
+"""
+
+import datetime
+import os
+import re
+import sys
+from db import *
+from storage import get_storage
+
+migration_pattern = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+# Tables, by name or alias in the checked queries, small enough to scan
+allowed_scans = {"domains", "d"}
+
+def get_migrations():
+    """
+    Lists the available migrations for the configured storage backend.
+
+    Returns:
+        List[Tuple[int, str, str]]: List of tuples containing the version,
+                                    name and path of each migration, in order.
+    """
+    migrations_dir = get_storage().migrations_dir
+    if not os.path.isdir(migrations_dir):
+        return []
+
+    migrations = []
+    for filename in sorted(os.listdir(migrations_dir)):
+        match = migration_pattern.match(filename)
+        if match:
+            migrations.append((
+                int(match.group(1)),
+                match.group(2),
+                os.path.join(migrations_dir, filename)
+            ))
+    return migrations
+
+def split_statements(sql):
+    """
+    Splits a migration file into statements, dropping comment lines.
+
+    Args:
+        sql (str): Contents of the migration file.
+
+    Returns:
+        List[str]: The SQL statements, without trailing semicolons.
+    """
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    statements = "\n".join(lines).split(";\n")
+    return [statement.strip().rstrip(";") for statement in statements if statement.strip()]
+
+def get_schema_version(connection):
+    """
+    Retrieves the version of the most recently applied migration, creating
+    the schema_version table if needed.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+
+    Returns:
+        int: The current schema version, 0 for a freshly imported schema.sql.
+    """
+    execute_query(connection, """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version int(11) NOT NULL,
+            name varchar(255) NOT NULL,
+            applied bigint(20) NOT NULL,
+            PRIMARY KEY (version)
+        )
+    """, fetch=False)
+    return execute_scalar(connection, "SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+def migrate(connection):
+    """
+    Applies every migration newer than the current schema version. Each
+    migration's version is recorded as soon as it has been applied, since
+    MySQL commits DDL statements implicitly.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    get_storage().initialize(connection)
+    version = get_schema_version(connection)
+    for migration_version, name, path in get_migrations():
+        if migration_version <= version:
+            continue
+
+        print(f"Applying migration {migration_version:04d} {name}")
+        with open(path, "r") as file:
+            statements = split_statements(file.read())
+        for statement in statements:
+            execute_query(connection, statement, fetch=False)
+
+        applied = int(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+        execute_query(
+            connection,
+            "INSERT INTO schema_version (version, name, applied) VALUES (%s, %s, %s)",
+            fetch=False,
+            params=(migration_version, name, applied)
+        )
+        connection.commit()
+        version = migration_version
+
+    print(f"Schema is at version {version}")
+    return version
+
+def check_report_indexes(connection):
+    """
+    Runs EXPLAIN on every report and alerts query and reports the ones that
+    read a table without using an index. Scans of the much smaller domains
+    table are allowed. Without a completed run, the queries are explained
+    for a placeholder run ID.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+
+    Returns:
+        List[str]: Names of the queries with a full table scan.
+    """
+    import reports, alerts
+
+    try:
+        run_id = get_current_run(connection)
+    except LookupError:
+        # 1 rather than 0, which would make the trends query's LIMIT 0 and
+        # let MySQL skip planning it
+        run_id = 1
+        print(f"No completed run yet, explaining for run ID {run_id}")
+
+    queries = dict(reports.report_queries)
+    queries.update(alerts.alert_queries)
+
+    unindexed = []
+    for name, query in queries.items():
+        scans = get_storage().explain_full_scans(
+            connection, query, (run_id,) * query.count("%s")
+        )
+        scanned = [table for table in scans if table not in allowed_scans]
+        if scanned:
+            unindexed.append(name)
+            print(f"{name}: full scan of {', '.join(scanned)}")
+        else:
+            print(f"{name}: ok")
+    return unindexed
+
+if __name__ == "__main__":
+    connection = create_conn()
+    if connection is None:
+        sys.exit(1)
+
+    try:
+        if "--check" in sys.argv[1:]:
+            sys.exit(1 if check_report_indexes(connection) else 0)
+        migrate(connection)
+    finally:
+        connection.close()
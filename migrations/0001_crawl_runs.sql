@@ -0,0 +1,34 @@
+-- Tables for revision-based crawl skipping and checkpointed crawl runs, and
+-- the run ID that addresses each urls row to the snapshot it belongs to
+
+CREATE TABLE `article_state` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `article_url` varchar(2083) NOT NULL,
+  `last_revid` bigint(20) DEFAULT NULL,
+  `last_updated` bigint(20) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `unique_article_url` (`article_url`) USING HASH
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `runs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `last_updated` bigint(20) NOT NULL,
+  `finished` bigint(20) DEFAULT NULL,
+  `status` varchar(16) NOT NULL,
+  `article_count` int(11) DEFAULT NULL,
+  `link_count` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `run_articles` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `run_id` int(11) NOT NULL,
+  `article_url` varchar(2083) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `unique_run_id_and_article_url` (`run_id`,`article_url`) USING HASH
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `urls`
+  ADD COLUMN `run_id` int(11) DEFAULT NULL AFTER `last_updated`,
+  ADD KEY `run_id` (`run_id`);
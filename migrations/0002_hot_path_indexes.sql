@@ -0,0 +1,34 @@
+-- Merge duplicate domains into the row with the lowest ID, keeping any
+-- status or flags set on the duplicates, so domains.domain can be unique
+
+CREATE TEMPORARY TABLE `domain_duplicates` AS
+SELECT d.id AS duplicate_id, k.keep_id
+FROM domains d
+JOIN (SELECT domain, MIN(id) AS keep_id FROM domains GROUP BY domain HAVING COUNT(*) > 1) k
+  ON k.domain = d.domain AND d.id <> k.keep_id;
+
+UPDATE domains k
+JOIN domain_duplicates dd ON dd.keep_id = k.id
+JOIN domains d ON d.id = dd.duplicate_id
+SET k.status = COALESCE(k.status, d.status),
+    k.perennial_source = COALESCE(k.perennial_source, d.perennial_source),
+    k.frequent_domain_notification = COALESCE(k.frequent_domain_notification, d.frequent_domain_notification),
+    k.flagged_domain_notification = COALESCE(k.flagged_domain_notification, d.flagged_domain_notification);
+
+UPDATE urls u
+JOIN domain_duplicates dd ON dd.duplicate_id = u.domain_id
+SET u.domain_id = dd.keep_id;
+
+DELETE d FROM domains d
+JOIN domain_duplicates dd ON dd.duplicate_id = d.id;
+
+DROP TEMPORARY TABLE `domain_duplicates`;
+
+ALTER TABLE `domains`
+  ADD UNIQUE KEY `domain` (`domain`);
+
+ALTER TABLE `urls`
+  ADD KEY `last_updated_domain_id` (`last_updated`,`domain_id`),
+  ADD KEY `run_id_domain_id` (`run_id`,`domain_id`),
+  DROP KEY `run_id`,
+  ADD KEY `appeared_on_article_notification` (`appeared_on_article_notification`);
@@ -0,0 +1,16 @@
+-- Replace the emulated hash unique key over two VARCHAR(2083) columns with
+-- a unique key over fixed-width MD5 digests of both URLs
+
+ALTER TABLE `urls`
+  ADD COLUMN `url_hash` binary(16) DEFAULT NULL AFTER `url_appeared_on`,
+  ADD COLUMN `url_appeared_on_hash` binary(16) DEFAULT NULL AFTER `url_hash`;
+
+UPDATE urls
+SET url_hash = UNHEX(MD5(url)),
+    url_appeared_on_hash = UNHEX(MD5(url_appeared_on));
+
+ALTER TABLE `urls`
+  MODIFY `url_hash` binary(16) NOT NULL,
+  DROP KEY `unique_url_and_url_appeared_on`,
+  ADD UNIQUE KEY `unique_url_hash_and_url_appeared_on_hash` (`url_hash`,`url_appeared_on_hash`),
+  ADD KEY `url_appeared_on_hash` (`url_appeared_on_hash`);
@@ -0,0 +1,21 @@
+-- Per-run summary of links to each domain, written when a run completes, so
+-- reports and alerts read a few thousand rows instead of joining all of urls
+
+CREATE TABLE `domain_usage` (
+  `run_id` int(11) NOT NULL,
+  `domain_id` int(11) NOT NULL,
+  `link_count` int(11) NOT NULL,
+  `article_count` int(11) NOT NULL,
+  `status` int(11) DEFAULT NULL,
+  PRIMARY KEY (`run_id`,`domain_id`),
+  KEY `domain_id` (`domain_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Summarize the current snapshot, if a run has already completed
+
+INSERT INTO domain_usage (run_id, domain_id, link_count, article_count, status)
+SELECT r.id, u.domain_id, COUNT(*), COUNT(DISTINCT u.url_appeared_on_hash), d.status
+FROM (SELECT MAX(id) AS id FROM runs WHERE status = 'complete') r
+JOIN urls u ON u.run_id >= r.id
+JOIN domains d ON u.domain_id = d.id
+GROUP BY r.id, u.domain_id, d.status;
@@ -0,0 +1,21 @@
+-- Per-run summary of links to each domain, written when a run completes, so
+-- reports and alerts read a few thousand rows instead of joining all of urls
+
+CREATE TABLE domain_usage (
+  run_id INTEGER NOT NULL,
+  domain_id INTEGER NOT NULL,
+  link_count INTEGER NOT NULL,
+  article_count INTEGER NOT NULL,
+  status INTEGER DEFAULT NULL,
+  PRIMARY KEY (run_id, domain_id)
+);
+CREATE INDEX domain_usage_domain_id ON domain_usage (domain_id);
+
+-- Summarize the current snapshot, if a run has already completed
+
+INSERT INTO domain_usage (run_id, domain_id, link_count, article_count, status)
+SELECT r.id, u.domain_id, COUNT(*), COUNT(DISTINCT u.url_appeared_on_hash), d.status
+FROM (SELECT MAX(id) AS id FROM runs WHERE status = 'complete') r
+JOIN urls u ON u.run_id >= r.id
+JOIN domains d ON u.domain_id = d.id
+GROUP BY r.id, u.domain_id, d.status;
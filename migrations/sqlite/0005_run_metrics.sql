@@ -0,0 +1,32 @@
+-- One row of dashboard metrics per completed run, so trends over many runs
+-- are read from a small table instead of the history of urls
+
+CREATE TABLE run_metrics (
+  run_id INTEGER NOT NULL PRIMARY KEY,
+  article_count INTEGER NOT NULL,
+  domain_count INTEGER NOT NULL,
+  link_count INTEGER NOT NULL,
+  reliable_links INTEGER NOT NULL,
+  flagged_links INTEGER NOT NULL,
+  unrated_links INTEGER NOT NULL,
+  reliable_domains INTEGER NOT NULL,
+  flagged_domains INTEGER NOT NULL,
+  unrated_domains INTEGER NOT NULL
+);
+
+-- Record the runs already summarized in domain_usage
+
+INSERT INTO run_metrics (run_id, article_count, domain_count, link_count,
+  reliable_links, flagged_links, unrated_links,
+  reliable_domains, flagged_domains, unrated_domains)
+SELECT r.id, r.article_count, COUNT(*), SUM(du.link_count),
+  SUM(CASE WHEN du.status IN (1, 2) THEN du.link_count ELSE 0 END),
+  SUM(CASE WHEN du.status IN (3, 4, 5, 6) THEN du.link_count ELSE 0 END),
+  SUM(CASE WHEN du.status IS NULL THEN du.link_count ELSE 0 END),
+  SUM(CASE WHEN du.status IN (1, 2) THEN 1 ELSE 0 END),
+  SUM(CASE WHEN du.status IN (3, 4, 5, 6) THEN 1 ELSE 0 END),
+  SUM(CASE WHEN du.status IS NULL THEN 1 ELSE 0 END)
+FROM runs r
+JOIN domain_usage du ON du.run_id = r.id
+WHERE r.status = 'complete'
+GROUP BY r.id, r.article_count;
@@ -0,0 +1,23 @@
+-- Articles linking to each domain listed by the report and the alerts,
+-- written when a run completes. urls rows are restamped by later runs before
+-- those complete, so the snapshot's articles cannot be read from urls.
+
+CREATE TABLE domain_articles (
+  run_id INTEGER NOT NULL,
+  domain_id INTEGER NOT NULL,
+  url_appeared_on TEXT NOT NULL,
+  url_appeared_on_hash BLOB NOT NULL,
+  PRIMARY KEY (run_id, domain_id, url_appeared_on_hash)
+);
+
+-- List the articles of the current snapshot, if a run has already completed,
+-- from the same rows its domain_usage summary was backfilled from
+-- The condition is utility.listed_domain_condition('du') at the time of
+-- writing; complete_run rewrites the table from it on every later run.
+
+INSERT INTO domain_articles (run_id, domain_id, url_appeared_on, url_appeared_on_hash)
+SELECT DISTINCT du.run_id, du.domain_id, u.url_appeared_on, u.url_appeared_on_hash
+FROM (SELECT MAX(id) AS id FROM runs WHERE status = 'complete') r
+JOIN domain_usage du ON du.run_id = r.id
+JOIN urls u ON u.domain_id = du.domain_id AND u.run_id >= du.run_id
+WHERE du.status IN (3, 4, 5, 6) OR (du.status IS NULL AND du.link_count >= 10);
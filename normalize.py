@@ -0,0 +1,129 @@
+"""
+URL-to-domain normalization shared by every ingest path.
+
+Links are unwrapped from web archive prefixes, reduced to their host and then
+to a first-level domain (or a canonical IP address for IP-based hosts). The
+host-to-domain step is memoized, since most links point to a few thousand
+hosts.
+"""
+
+import ipaddress
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+from tld import get_fld
+
+# Maximum number of distinct hosts kept in the domain cache
+DOMAIN_CACHE_SIZE = 65536
+
+# Prefixes of web archives that wrap the original URL in their own
+archive_prefixes = [
+    re.compile(r'^https?://(?:web\.|wayback\.)?archive\.org/web/\d{0,14}(?:[a-z]{2}_)?/', re.IGNORECASE),
+    re.compile(r'^https?://wayback\.archive-it\.org/\d+/\d{0,14}(?:[a-z]{2}_)?/', re.IGNORECASE),
+    re.compile(r'^https?://archive\.(?:today|ph|is|li|vn|fo|md)/(?:\d{14}|newest|oldest)/', re.IGNORECASE),
+    re.compile(r'^https?://(?:www\.)?webcitation\.org/query\?url=', re.IGNORECASE),
+    re.compile(r'^https?://webarchive\.(?:nationalarchives\.gov\.uk|loc\.gov)/(?:all/)?\d{14}/', re.IGNORECASE),
+]
+
+scheme_pattern = re.compile(r'^[a-z][a-z0-9+.-]*://', re.IGNORECASE)
+
+# A scheme-less link that starts with a dotted host name or IPv4 address,
+# optionally followed by a port, e.g. "www.example.com/page"
+host_like_pattern = re.compile(r'^[a-z0-9-]+(?:\.[a-z0-9-]+)+\.?(?::\d+)?(?:[/?#]|$)', re.IGNORECASE)
+
+def strip_archive_prefix(url):
+    """
+    Removes web archive prefixes from a URL, including nested ones.
+
+    Args:
+        url (str): The URL, with or without an archive prefix.
+
+    Returns:
+        str: The original URL that was archived.
+    """
+    stripped = True
+    while stripped:
+        stripped = False
+        for pattern in archive_prefixes:
+            match = pattern.match(url)
+            if match:
+                url = url[match.end():]
+                stripped = True
+    return url
+
+def get_host(url):
+    """
+    Extracts the lowercased host name from a URL.
+
+    Args:
+        url (str): The URL. A missing scheme is tolerated when the URL starts
+                   with a host name.
+
+    Returns:
+        str: The host name, or None if the URL has none, as with mailto:,
+             tel: or news: links.
+    """
+    if url.startswith("//"):
+        url = "http:" + url
+    elif not scheme_pattern.match(url):
+        if not host_like_pattern.match(url):
+            return None
+        url = "http://" + url
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host.rstrip(".")
+
+@lru_cache(maxsize=DOMAIN_CACHE_SIZE)
+def host_to_domain(host):
+    """
+    Reduces a host name to its first-level domain. IPv4 and IPv6 addresses are
+    returned in canonical form.
+
+    Args:
+        host (str): The lowercased host name.
+
+    Returns:
+        str: The first-level domain or IP address, or None if the host has no
+             recognizable domain.
+    """
+    try:
+        return ipaddress.ip_address(host).compressed
+    except ValueError:
+        pass
+
+    try:
+        return get_fld(host, fix_protocol=True, fail_silently=True)
+    except Exception:
+        return None
+
+def url_to_domain(url):
+    """
+    Unwraps an archived URL and determines its first-level domain.
+
+    Args:
+        url (str): The URL as linked.
+
+    Returns:
+        tuple: A tuple containing the unwrapped URL and its domain, or None for
+               the domain if it could not be determined.
+    """
+    url = strip_archive_prefix(url)
+    host = get_host(url)
+    return url, host_to_domain(host) if host else None
+
+def urls_to_domains(urls):
+    """
+    Unwraps and resolves the domains of many URLs.
+
+    Args:
+        urls (iterable): The URLs as linked.
+
+    Returns:
+        list: A list of tuples containing each unwrapped URL and its domain,
+              in input order, with None for undeterminable domains.
+    """
+    return [url_to_domain(url) for url in urls]
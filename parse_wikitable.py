@@ -3,7 +3,7 @@ This script fetches the raw content of the "Wikipedia:Vaccine safety/Perennial s
 parses the table, and outputs the extracted data as a CSV file to stdout.
 """
 
-import requests
+import transport
 import csv
 import sys
 
@@ -19,7 +19,7 @@ def get_table_row():
     """
     url = "https://en.wikipedia.org/wiki/Wikipedia:Vaccine_safety/Perennial_sources?action=raw"
 
-    response = requests.get(url)
+    response = transport.get(url)
 
     if response.status_code == 200:
         content = response.text.splitlines()
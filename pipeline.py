@@ -0,0 +1,186 @@
+"""
+Runs a small dependency graph of stages, running stages whose dependencies
+have finished concurrently on a thread pool.
+
+Each stage's function receives the results of its dependencies. A stage may
+also compute a fingerprint of its inputs: when the fingerprint matches the
+one recorded at the last successful run of the pipeline (kept in
+VSAFE_PIPELINE_STATE, default "pipeline_state.json"), the stage is skipped,
+and so are the stages depending on it.
+"""
+
+import json
+import os
+import tempfile
+import instrument
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+state_path = os.environ.get("VSAFE_PIPELINE_STATE", "pipeline_state.json")
+
+Stage = namedtuple("Stage", ["name", "function", "deps", "fingerprint"], defaults=((), None))
+Stage.__doc__ = """
+One stage of the pipeline. function takes a dict of the results of deps by
+stage name. fingerprint, if given, takes the same dict and returns a string
+identifying the stage's inputs.
+"""
+
+def load_state(path):
+    """
+    Reads the fingerprints recorded by the last successful run.
+
+    Args:
+        path (str): Path of the state file.
+
+    Returns:
+        dict: A mapping of stage name to fingerprint.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+def save_state(path, state):
+    """
+    Writes the fingerprints atomically.
+
+    Args:
+        path (str): Path of the state file.
+        state (dict): A mapping of stage name to fingerprint.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "w") as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def check_graph(stages):
+    """
+    Checks that the stages form a graph the runner can complete.
+
+    Args:
+        stages (List[Stage]): The stages.
+
+    Raises:
+        ValueError: If a stage name is repeated, a dependency is unknown or
+                    the dependencies form a cycle.
+    """
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate stage names")
+
+    by_name = {stage.name: stage for stage in stages}
+    visiting, visited = set(), set()
+
+    def visit(stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Stage {stage.name} depends on itself")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        visited.add(stage.name)
+
+    for stage in stages:
+        visit(stage)
+
+def run_stage(stage, inputs):
+    # Runs one stage under the instrumentation of its wall and CPU time
+    with instrument.stage(stage.name):
+        return stage.function(inputs)
+
+def run_stages(stages, selected=None, force=False, workers=4, path=None, save=True):
+    """
+    Runs the stages, each as soon as its dependencies have finished.
+
+    Args:
+        stages (List[Stage]): The stages.
+        selected (Iterable[str], optional): Names of the stages to run. The
+            others are left out, along with their results; selected stages
+            always run, whatever their fingerprint. All stages by default.
+        force (bool, optional): Run every stage even if its inputs are
+                                unchanged.
+        workers (int, optional): Maximum number of stages running at once.
+        path (str, optional): Path of the state file. Defaults to
+                              VSAFE_PIPELINE_STATE.
+        save (bool, optional): Record the fingerprints of this run. Dry runs
+                               must not, or the next real run would skip
+                               the stages they only pretended to complete.
+
+    Returns:
+        dict: The results of the stages that ran, by stage name.
+
+    Raises:
+        ValueError: If the graph is invalid or a selected stage is unknown.
+        Exception: The first exception raised by a stage, once the stages
+                   already running have finished. The state file is then
+                   left unchanged.
+    """
+    check_graph(stages)
+    path = path or state_path
+    names = {stage.name for stage in stages}
+    if selected is None:
+        selected = names
+    else:
+        selected = set(selected)
+        force = True
+        if selected - names:
+            raise ValueError(f"Unknown stages: {', '.join(sorted(selected - names))}")
+
+    state = load_state(path)
+    new_state = dict(state)
+    pending = [stage for stage in stages if stage.name in selected]
+    results, skipped, running = {}, set(), {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Start every stage whose dependencies are done, repeating while
+            # skipped stages unblock others
+            progress = error is None
+            while progress:
+                progress = False
+                for stage in list(pending):
+                    deps = [dep for dep in stage.deps if dep in selected]
+                    if any(dep not in results and dep not in skipped for dep in deps):
+                        continue
+                    pending.remove(stage)
+                    progress = True
+
+                    inputs = {dep: results[dep] for dep in deps if dep in results}
+                    if any(dep in skipped for dep in deps):
+                        print(f"Skipping {stage.name}: its inputs are unchanged")
+                        skipped.add(stage.name)
+                        continue
+                    if stage.fingerprint is not None:
+                        fingerprint = stage.fingerprint(inputs)
+                        if not force and state.get(stage.name) == fingerprint:
+                            print(f"Skipping {stage.name}: its inputs are unchanged")
+                            skipped.add(stage.name)
+                            continue
+                        new_state[stage.name] = fingerprint
+
+                    print(f"Starting {stage.name}")
+                    running[executor.submit(run_stage, stage, inputs)] = stage
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                    print(f"Finished {stage.name}")
+                except Exception as e:
+                    print(f"Stage {stage.name} failed: {e}")
+                    error = error or e
+
+    if error is not None:
+        raise error
+    if save:
+        save_state(path, new_state)
+    return results
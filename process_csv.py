@@ -1,13 +1,14 @@
 """
 This script processes a CSV file containing information about perennial sources,
-prepares the data for SQL insertion, and inserts the data into a MySQL database.
+prepares the data for SQL insertion, and inserts the data into the references database.
 """
 
 import csv
 import re
-import pymysql
 import sys
-from credentials import hostname, dbname, username, password
+from db import create_conn
+from normalize import url_to_domain
+from storage import get_storage
 
 def process_csv(input_file):
     """
@@ -110,8 +111,10 @@ def prep_csv_for_sql(input_file):
         for row in csvreader:
             processed_row = {}
             # Process row_url
-            urls = row["url"].replace("https://", "").replace("http://", "").split("/")
-            processed_row["domain"] = urls[0]
+            _, domain = url_to_domain(row["url"])
+            if domain is None:
+                domain = row["url"].replace("https://", "").replace("http://", "").split("/")[0]
+            processed_row["domain"] = domain
 
             # Process row_status
             if "assessmentStatus" in row:
@@ -136,15 +139,19 @@ def insert_into_db(rows):
     Raises:
         Exception: If there's an error inserting data into the database.
     """
+    conn = None
     try:
-        conn = pymysql.connect(user=username, password=password,
-                               host=hostname, database=dbname)
+        conn = create_conn()
         cursor = conn.cursor()
 
+        sql = get_storage().upsert_query(
+            "domains",
+            ("domain", "status", "perennial_source"),
+            ("domain",),
+            ("status", "perennial_source")
+        )
         for row in rows:
             if row['status'] is not None:
-                sql = """INSERT INTO domains (domain, status, perennial_source) 
-                            VALUES (%s, %s, %s)"""
                 val = (row['domain'], row['status'], row['perennial_source'])
                 cursor.execute(sql, val)
                 conn.commit()
@@ -155,7 +162,7 @@ def insert_into_db(rows):
         print(f"Error inserting data into the database: {e}")
 
     finally:
-        if conn.open:
+        if conn is not None and conn.open:
             conn.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+"""
+Publishing layer for the pages the bot writes on Wikipedia.
+
+One Publisher per run reuses the pywikibot site from the resource registry
+and each page's Page object. Page text is read as raw wikitext through
+transport.get, so it is recorded and replayed like every other read, and is
+fetched at most once per run whether it is read as the base of an edit or
+compared before saving.
+
+The SHA-256 hash and revision ID of every page saved are kept in a local
+state file (VSAFE_PUBLISH_STATE, default "publish_state.json"). A page whose
+rendered content hashes the same as its last save is skipped without fetching
+it from the wiki at all.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import instrument
+import resources
+import transport
+
+state_path = os.environ.get("VSAFE_PUBLISH_STATE", "publish_state.json")
+
+# Endpoint serving the raw wikitext of a page with action=raw
+raw_url = "https://en.wikipedia.org/w/index.php"
+
+def content_hash(content):
+    """
+    Computes the hash recorded for a page's content.
+
+    Args:
+        content (str): The page wikitext.
+
+    Returns:
+        str: The hex SHA-256 digest of the content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class Publisher:
+    """
+    Reads and saves wiki pages through one site session, skipping saves of
+    unchanged content. Pages may be published from several threads, since
+    independent bot stages run concurrently.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): Path of the state file. Defaults to
+                                  VSAFE_PUBLISH_STATE.
+        """
+        self.path = path or state_path
+        self.pages = {}
+        self.texts = {}
+        self.state = self.load_state()
+        # Guards the state and its file against concurrent publish calls
+        self.lock = threading.Lock()
+
+    def load_state(self):
+        """
+        Reads the hash and revision ID of each page saved by earlier runs.
+
+        Returns:
+            dict: A mapping of page title to a dict with "hash" and "revid".
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def save_state(self):
+        """
+        Writes the state file atomically. Callers hold self.lock.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as file:
+            json.dump(self.state, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def get_page(self, title):
+        """
+        Returns the run's Page object of a title, creating it on first use.
+
+        Args:
+            title (str): The page title.
+
+        Returns:
+            pywikibot.Page: The page.
+        """
+        import pywikibot
+
+        if title not in self.pages:
+            self.pages[title] = pywikibot.Page(resources.get("site"), title)
+        return self.pages[title]
+
+    def get_text(self, title):
+        """
+        Fetches the current wikitext of a page through the HTTP transport. The
+        text is kept for the run, so later reads and the comparison before
+        saving reuse it.
+
+        Args:
+            title (str): The page title.
+
+        Returns:
+            str: The page wikitext, or None if the page does not exist.
+
+        Raises:
+            requests.HTTPError: If the wiki answers with an error other than
+                                a missing page.
+        """
+        if title not in self.texts:
+            response = transport.get(raw_url, params={"title": title, "action": "raw"}, timeout=60)
+            if response.status_code == 404:
+                self.texts[title] = None
+            else:
+                response.raise_for_status()
+                self.texts[title] = response.text
+        return self.texts[title]
+
+    def publish(self, title, content, summary=None):
+        """
+        Saves a page unless its content is unchanged, creating it if needed.
+        Nothing is saved or recorded when recording or replaying HTTP
+        responses (see transport.dry_run()).
+
+        Args:
+            title (str): The page title.
+            content (str): The new page wikitext.
+            summary (str, optional): The edit summary.
+
+        Returns:
+            bool: Whether the page was saved.
+        """
+        if transport.dry_run():
+            print(f"Dry run: {title} not saved ({len(content)} characters).")
+            instrument.count("pages_skipped")
+            return False
+
+        digest = content_hash(content)
+        if self.state.get(title, {}).get("hash") == digest:
+            print(f"{title} is unchanged since its last save.")
+            instrument.count("pages_skipped")
+            return False
+
+        page = self.get_page(title)
+        saved = False
+        if self.get_text(title) == content:
+            print(f"{title} has no changes.")
+            instrument.count("pages_skipped")
+        else:
+            page.text = content
+            page.save(summary or f"Updating {title} with new content")
+            self.texts[title] = content
+            print(f"{title} has been updated.")
+            instrument.count("pages_saved")
+            saved = True
+
+        with self.lock:
+            self.state[title] = {"hash": digest, "revid": page.latest_revision_id}
+            self.save_state()
+        return saved
+
+    def publish_all(self, pages, summary=None):
+        """
+        Saves several pages in order, skipping the unchanged ones.
+
+        Args:
+            pages (dict): A mapping of page title to new page wikitext.
+            summary (str, optional): The edit summary of every save.
+
+        Returns:
+            int: Number of pages saved.
+        """
+        return sum(self.publish(title, content, summary) for title, content in pages.items())
@@ -1,130 +1,298 @@
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import sys
 from utility import *
 from db import *
 
-# Connect to the MySQL database
-connection = create_conn()
-cursor = connection.cursor() if connection is not None else None
+# Number of articles in the current snapshot, recorded when its run completed
+articles_in_scope_query = '''
+    SELECT article_count
+    FROM runs
+    WHERE id = %s
+'''
 
-def get_last_updated():
+# Links to each domain in the current snapshot, from the per-run summary
+domain_usage_query = '''
+    SELECT du.domain_id, d.domain, du.status, du.link_count, du.article_count
+    FROM domain_usage du
+    JOIN domains d ON du.domain_id = d.id
+    WHERE du.run_id = %s
+    ORDER BY du.domain_id
+'''
+
+# Articles linking to the domains listed in the report tables: flagged
+# domains and frequently used unrated ones, as recorded when the run completed
+domain_articles_query = '''
+    SELECT domain_id, url_appeared_on
+    FROM domain_articles
+    WHERE run_id = %s
+    ORDER BY domain_id, url_appeared_on
+'''
+
+# Dashboard metrics of the most recent runs up to the current snapshot
+trends_query = '''
+    SELECT m.run_id, r.finished, m.article_count, m.domain_count, m.link_count,
+        m.reliable_links, m.flagged_links, m.unrated_links
+    FROM run_metrics m
+    JOIN runs r ON r.id = m.run_id
+    WHERE m.run_id <= %s
+    ORDER BY m.run_id DESC
+    LIMIT %s
+'''
+
+# Every query generate_wikipage runs against the current snapshot, by name
+report_queries = {
+    "articles_in_scope": articles_in_scope_query,
+    "domain_usage": domain_usage_query,
+    "domain_articles": domain_articles_query,
+    "trends": trends_query,
+}
+
+# Number of runs shown in the trends section of the report
+TREND_RUNS = 10
+
+# Columns of the trends section and export
+trend_columns = [
+    "run_id", "finished", "articles", "domains",
+    "percent_reliable", "percent_flagged", "percent_unrated",
+]
+
+def aggregate_domain_usage(rows, domain_articles):
     """
-    Retrieves the most recent 'last updated' timestamp in the 'urls' table.
+    Aggregates the rows of domain_usage_query into report figures.
+
+    Args:
+        rows (List[Tuple[int, str, int, int, int]]): Tuples of domain_id,
+            domain, status, link count and article count.
+        domain_articles (List[Tuple[int, str]]): Tuples of domain_id and
+            url_appeared_on, in article order, as returned by
+            domain_articles_query.
 
     Returns:
-        int: The maximum last_updated value from the 'urls' table.
+        dict: A dict with the total "links", per-bucket "buckets" counts of
+              links and domains, and "domains_by_id" mapping each domain ID
+              to its domain, status, link count and list of articles.
     """
-    max_last_updated_query = '''
-    SELECT MAX(last_updated) as max_last_updated
-    FROM urls
-    '''
-    return execute_scalar(connection, max_last_updated_query)
+    bucket_of_status = {
+        status: bucket for bucket, statuses in status_buckets.items() for status in statuses
+    }
+    buckets = {bucket: {"links": 0, "domains": 0} for bucket in status_buckets}
+    domains_by_id = {}
+    links = 0
+
+    for domain_id, domain, status, link_count, article_count in rows:
+        links += link_count
+        domains_by_id[domain_id] = {
+            "domain": domain, "status": status, "links": link_count, "articles": []
+        }
+
+        bucket = bucket_of_status.get(status)
+        if bucket is not None:
+            buckets[bucket]["links"] += link_count
+            buckets[bucket]["domains"] += 1
 
-def generate_wikipage():
+    for domain_id, article in domain_articles:
+        domains_by_id[domain_id]["articles"].append(article)
+
+    return {
+        "links": links,
+        "buckets": buckets,
+        "domains_by_id": domains_by_id,
+    }
+
+def percent_of_links(snapshot, bucket):
     """
-    Generates wiki page content based on several database queries.
+    Computes the share of the snapshot's links falling in a status bucket.
+
+    Args:
+        snapshot (dict): The figures returned by aggregate_domain_usage.
+        bucket (str): Name of the bucket in status_buckets.
 
     Returns:
-        str: The wiki page content as a formatted string.
-    """
-    last_updated = get_last_updated()
-
-    articles_in_scope_query = '''
-        SELECT COUNT(DISTINCT url_appeared_on) as articles_in_scope
-        FROM urls
-        WHERE last_updated = %s
-    '''
-
-    domains_linked_query = '''
-        SELECT COUNT(DISTINCT domain) FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE u.last_updated = %s
-    '''
-
-    links_to_known_reliable_sources_query = '''
-        SELECT ROUND((COUNT(*) * 100.0 / (SELECT COUNT(*) FROM urls WHERE last_updated = %s)), 1)
-               as links_to_known_reliable_sources
-        FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE d.status IN (1, 2) AND u.last_updated = %s
-    '''
-
-    links_to_unknown_domains_query = '''
-        SELECT ROUND((COUNT(*) * 100.0 / (SELECT COUNT(*) FROM urls WHERE last_updated = %s)), 1)
-               as links_to_unknown_domains
-        FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE d.status IS NULL AND u.last_updated = %s
-    '''
-
-    links_to_flagged_sources_query = '''
-        SELECT ROUND((COUNT(*) * 100.0 / (SELECT COUNT(*) FROM urls WHERE last_updated = %s)), 1)
-               as links_to_flagged_sources
-        FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE d.status IN (3, 4, 5, 6) AND u.last_updated = %s
-    '''
-
-    flagged_domains_query = '''
-        SELECT d.domain, d.status, GROUP_CONCAT(DISTINCT u.url_appeared_on) as urls_appeared_on
-        FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE d.status IN (3, 4, 5, 6) AND u.last_updated = %s
-        GROUP BY d.domain
-    '''
-
-    frequent_domains_query = '''
-        SELECT d.domain, COUNT(u.id) as url_count, GROUP_CONCAT(DISTINCT u.url_appeared_on) as urls_appeared_on
-        FROM urls u
-        JOIN domains d ON u.domain_id = d.id
-        WHERE d.status IS NULL AND u.last_updated = %s
-        GROUP BY d.domain
-        HAVING COUNT(u.id) >= 10
-        ORDER BY url_count DESC
-    '''
-
-    articles_in_scope = execute_scalar(
-        connection, articles_in_scope_query, params=(last_updated,)
-    )
-    domains_linked = execute_scalar(
-        connection, domains_linked_query, params=(last_updated,)
-    )
-    links_to_known_reliable_sources = execute_scalar(
-        connection,
-        links_to_known_reliable_sources_query,
-        params=(last_updated, last_updated)
-    )
-    links_to_unknown_domains = execute_scalar(
-        connection,
-        links_to_unknown_domains_query,
-        params=(last_updated, last_updated)
-    )
-    links_to_flagged_sources = execute_scalar(
+        float: The percentage rounded to one decimal, or None for an empty
+               snapshot.
+    """
+    return percent(snapshot["buckets"][bucket]["links"], snapshot["links"])
+
+def percent(part, total):
+    """
+    Computes a percentage for the metrics dashboard.
+
+    Args:
+        part (int): The counted links.
+        total (int): All links.
+
+    Returns:
+        float: The percentage rounded to one decimal, or None if total is 0.
+    """
+    if not total:
+        return None
+    return round(part * 100.0 / total, 1)
+
+def get_trends(connection, run_id, runs=TREND_RUNS):
+    """
+    Retrieves the dashboard metrics of the most recent runs from the
+    run_metrics time series.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+        run_id (int): The ID of the last run to include.
+        runs (int, optional): Number of runs to include.
+
+    Returns:
+        List[dict]: The metrics of each run, keyed by trend_columns, oldest
+                    run first.
+    """
+    trends = []
+    rows = execute_query(connection, trends_query, params=(run_id, runs))
+    for (run, finished, articles, domains, links,
+         reliable_links, flagged_links, unrated_links) in reversed(rows):
+        trends.append({
+            "run_id": run,
+            "finished": datetime.datetime.strptime(str(finished), "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M"),
+            "articles": articles,
+            "domains": domains,
+            "percent_reliable": percent(reliable_links, links),
+            "percent_flagged": percent(flagged_links, links),
+            "percent_unrated": percent(unrated_links, links),
+        })
+    return trends
+
+def export_trends(sink, runs=TREND_RUNS, session=None):
+    """
+    Writes the dashboard metrics of the most recent runs as CSV.
+
+    Args:
+        sink (TextIO): File-like object to write the CSV to.
+        runs (int, optional): Number of runs to include.
+        session (db.Session, optional): Database session shared with the other
+                                        bot stages.
+    """
+    with stage_connection(session, "reports") as connection:
+        trends = get_trends(connection, get_current_run(connection), runs)
+
+    writer = csv.DictWriter(sink, fieldnames=trend_columns)
+    writer.writeheader()
+    writer.writerows(trends)
+
+def snapshot_fingerprint(connection):
+    """
+    Identifies the contents of the current snapshot as summarized in
+    domain_usage and domain_articles, so that stages computed from it can be
+    skipped when a new run changed nothing.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection.
+
+    Returns:
+        str: A hex digest of the snapshot's article count, domain usage and
+             listed articles.
+    """
+    run_id = get_current_run(connection)
+    digest = hashlib.sha256()
+    digest.update(repr(execute_scalar(connection, articles_in_scope_query, params=(run_id,))).encode("utf-8"))
+    rows = execute_query(
         connection,
-        links_to_flagged_sources_query,
-        params=(last_updated, last_updated)
+        "SELECT domain_id, link_count, article_count, status FROM domain_usage"
+        " WHERE run_id = %s ORDER BY domain_id",
+        params=(run_id,)
     )
-    flagged_domains = execute_query(
-        connection, flagged_domains_query, params=(last_updated,)
+    rows = list(rows) + list(execute_query(connection, domain_articles_query, params=(run_id,)))
+    for row in rows:
+        digest.update(repr(tuple(row)).encode("utf-8"))
+    return digest.hexdigest()
+
+def generate_wikipage(session=None, sink=None):
+    """
+    Generates wiki page content from the domain_usage summary of the current
+    snapshot.
+
+    Args:
+        session (db.Session, optional): Database session shared with the other
+                                        bot stages.
+        sink (TextIO, optional): File-like object to stream the page to
+                                 instead of building it in memory.
+
+    Returns:
+        str: The wiki page content as a formatted string, or None if it was
+             written to a sink.
+    """
+    with stage_connection(session, "reports", consistent_snapshot=True) as connection:
+        run_id = get_current_run(connection)
+        articles_in_scope = execute_scalar(connection, articles_in_scope_query, params=(run_id,))
+        snapshot = aggregate_domain_usage(
+            execute_query(connection, domain_usage_query, params=(run_id,)),
+            execute_query(connection, domain_articles_query, params=(run_id,))
+        )
+        trends = get_trends(connection, run_id)
+
+    domains_linked = len(snapshot["domains_by_id"])
+    links_to_known_reliable_sources = percent_of_links(snapshot, "reliable")
+    links_to_flagged_sources = percent_of_links(snapshot, "flagged")
+    links_to_unknown_domains = percent_of_links(snapshot, "unrated")
+
+    domains = snapshot["domains_by_id"].values()
+    frequent_domains = sorted(
+        (
+            (entry["domain"], entry["links"], entry["articles"])
+            for entry in domains
+            if entry["status"] in status_buckets["unrated"]
+            and entry["links"] >= FREQUENT_DOMAIN_MIN_LINKS
+        ),
+        # Ties broken by domain, so an unchanged snapshot renders the same
+        # page and its save is skipped
+        key=lambda row: (-row[1], row[0])
     )
-    frequent_domains = execute_query(
-        connection, frequent_domains_query, params=(last_updated,)
+    flagged_domains = sorted(
+        (entry["domain"], entry["status"], entry["articles"])
+        for entry in domains
+        if entry["status"] in status_buckets["flagged"]
     )
 
+    dashboard = {
+        "articles": articles_in_scope,
+        "domains": domains_linked,
+        "percent_reliable": links_to_known_reliable_sources,
+        "percent_flagged": links_to_flagged_sources,
+        "percent_unrated": links_to_unknown_domains,
+    }
+
+    if sink is not None:
+        render_wikipage(sink, dashboard, frequent_domains, flagged_domains, trends)
+        return None
+
+    buffer = io.StringIO()
+    render_wikipage(buffer, dashboard, frequent_domains, flagged_domains, trends)
+    wiki_page = buffer.getvalue()
+    print(wiki_page)
+    return wiki_page
 
-    # Close the connection to the database
-    if cursor:
-        cursor.close()
-    if connection:
-        connection.close()
+def render_wikipage(sink, dashboard, frequent_domains, flagged_domains, trends):
+    """
+    Writes the wiki page to a file-like sink, one table row at a time.
 
-    # Create the wiki page content
-    wiki_page = f"""
+    Args:
+        sink (TextIO): Object with a write method receiving the wikitext.
+        dashboard (dict): Values of the VSAFE metrics dashboard parameters.
+        frequent_domains (Iterable[Tuple[str, int, Sequence[str]]]): Tuples of
+            domain, link count and article URLs of frequently used unrated
+            domains.
+        flagged_domains (Iterable[Tuple[str, int, Sequence[str]]]): Tuples of
+            domain, status and article URLs of flagged domains.
+        trends (Iterable[dict], optional): Metrics of recent runs, as returned
+            by get_trends.
+    """
+    sink.write(f"""
 {{{{Vaccine safety tabs}}}}
 <onlyinclude>{{{{VSAFE metrics dashboard
-| articles = {articles_in_scope}
-| domains = {domains_linked}
-| percent_reliable = {links_to_known_reliable_sources}
-| percent_flagged = {links_to_flagged_sources}
-| percent_unrated = {links_to_unknown_domains}
+| articles = {dashboard["articles"]}
+| domains = {dashboard["domains"]}
+| percent_reliable = {dashboard["percent_reliable"]}
+| percent_flagged = {dashboard["percent_flagged"]}
+| percent_unrated = {dashboard["percent_unrated"]}
 | last_updated = ~~~~~
 }}}}</onlyinclude>
 
@@ -134,17 +302,17 @@ def generate_wikipage():
 ! Count
 ! Appears on articles
 |-
-"""
+""")
 
     for domain, url_count, urls_appeared_on in frequent_domains:
-        wiki_page += f"""
+        sink.write(f"""
 | {domain}
 | {url_count}
 | {{{{hidden|1=Article links|content={to_wikilinks(urls_appeared_on)}}}}}
 |-
-"""
+""")
 
-    wiki_page += """
+    sink.write("""
 |}
 
 ==Flagged domain use==
@@ -153,22 +321,52 @@ def generate_wikipage():
 ! Status
 ! Appears on articles
 |-
-"""
+""")
 
     for domain, status, urls_appeared_on in flagged_domains:
-        wiki_page += f"""
+        sink.write(f"""
 | {domain}
 | {{{{vsrate|{status_to_template[status]}}}}}
 | {{{{hidden|1=Article links|content={to_wikilinks(urls_appeared_on)}}}}}
 |-
-"""
+""")
 
-    wiki_page += """
+    sink.write("""
 |}
-"""
-    print(wiki_page)
-    return wiki_page
 
-# Print the wiki page content
+==Trends==
+{| class="wikitable sortable"
+! Run finished
+! Articles
+! Domains
+! Percent reliable
+! Percent flagged
+! Percent unrated
+|-
+""")
+
+    for run in trends:
+        sink.write(f"""
+| {run["finished"]}
+| {run["articles"]}
+| {run["domains"]}
+| {run["percent_reliable"]}
+| {run["percent_flagged"]}
+| {run["percent_unrated"]}
+|-
+""")
+
+    sink.write("""
+|}
+""")
+
+# Print the wiki page content, or the trends as CSV
 if __name__ == '__main__':
-    generate_wikipage()
+    parser = argparse.ArgumentParser(description="Generate the Vaccine safety reports page")
+    parser.add_argument("--trends", type=int, metavar="RUNS",
+                        help="write the dashboard metrics of the last RUNS runs as CSV instead")
+    args = parser.parse_args()
+    if args.trends:
+        export_trends(sys.stdout, args.trends)
+    else:
+        generate_wikipage(sink=sys.stdout)
@@ -0,0 +1,150 @@
+"""
+Registry of the shared resources that are expensive to create: the database
+session, the pywikibot site and the publisher saving pages through it, the
+Domains Wikibase login and its SPARQL results.
+
+Each resource is created by its factory the first time get() asks for it and
+reused afterwards, so importing a module never opens a connection or sends a
+request. close() releases everything created so far.
+
+Usage:
+    site = resources.get("site")
+    ...
+    resources.close()
+"""
+
+import threading
+
+wikibase_api_url = "https://domains.wikibase.cloud/w/api.php"
+wikibase_sparql_endpoint = "https://domains.wikibase.cloud/query/sparql"
+
+# Name of each resource mapped to its factory and to its close function
+factories = {}
+closers = {}
+
+instances = {}
+lock = threading.RLock()
+
+def register(name, factory, close=None):
+    """
+    Registers how to create a resource, replacing any earlier registration.
+
+    Args:
+        name (str): Name of the resource.
+        factory (Callable[[], Any]): Creates the resource.
+        close (Callable[[Any], None], optional): Releases the resource.
+    """
+    with lock:
+        factories[name] = factory
+        closers[name] = close
+
+def get(name):
+    """
+    Returns a resource, creating it on first use.
+
+    Args:
+        name (str): Name of the resource.
+
+    Returns:
+        Any: The resource.
+
+    Raises:
+        KeyError: If no resource of that name is registered.
+    """
+    with lock:
+        if name not in instances:
+            instances[name] = factories[name]()
+        return instances[name]
+
+def close():
+    """
+    Releases every resource created so far, in reverse order of creation, so
+    that the next get() creates them anew.
+    """
+    with lock:
+        while instances:
+            name, instance = instances.popitem()
+            if closers.get(name) is not None:
+                closers[name](instance)
+
+def create_session():
+    """
+    Opens the database session shared by the bot stages.
+
+    Returns:
+        db.Session: The session.
+    """
+    import db
+
+    return db.Session()
+
+def create_site():
+    """
+    Connects to the wiki the bot publishes to.
+
+    Returns:
+        pywikibot.Site: The site configured in user-config.py.
+    """
+    import pywikibot
+
+    return pywikibot.Site()
+
+def create_publisher():
+    """
+    Creates the publisher saving the bot's pages through the shared site.
+
+    Returns:
+        publish.Publisher: The publisher.
+    """
+    import publish
+
+    return publish.Publisher()
+
+def create_wikibase_login():
+    """
+    Logs in to the Domains Wikibase.
+
+    Returns:
+        wdi_login.WDLogin: The login session.
+    """
+    from wikidataintegrator import wdi_login
+    from credentials import wikibase_username, wikibase_password
+
+    return wdi_login.WDLogin(
+        user=wikibase_username,
+        pwd=wikibase_password,
+        mediawiki_api_url=wikibase_api_url,
+        mediawiki_index_url="https://domains.wikibase.cloud/w/index.php",
+        user_agent="Vsafe-Data/1.0 (james@scatter.red)"
+    )
+
+def fetch_wikibase_domains():
+    """
+    Queries the Domains Wikibase for its items and their domain values
+    (property P1).
+
+    Returns:
+        dict: A mapping of domain to the URI of its item.
+    """
+    import transport
+
+    query = """
+    PREFIX wdt: <https://domains.wikibase.cloud/prop/direct/>
+    PREFIX wd: <https://domains.wikibase.cloud/entity/>
+
+    SELECT ?item ?P1_value
+    WHERE {
+      ?item wdt:P1 ?P1_value .
+    }
+    """
+    response = transport.get(wikibase_sparql_endpoint, params={'query': query, 'format': 'json'})
+    return {
+        result['P1_value']['value']: result['item']['value']
+        for result in response.json()['results']['bindings']
+    }
+
+register("session", create_session, close=lambda session: session.close())
+register("site", create_site)
+register("publisher", create_publisher)
+register("wikibase_login", create_wikibase_login)
+register("wikibase_domains", fetch_wikibase_domains)
@@ -0,0 +1,100 @@
+-- Schema of the references database for the embedded SQLite backend.
+-- Equivalent to schema.sql with the migrations up to version 6 applied;
+-- later SQLite migrations live in migrations/sqlite.
+
+CREATE TABLE domains (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  domain TEXT NOT NULL COLLATE NOCASE,
+  status INTEGER DEFAULT NULL,
+  perennial_source INTEGER DEFAULT NULL,
+  frequent_domain_notification INTEGER DEFAULT NULL,
+  flagged_domain_notification INTEGER DEFAULT NULL
+);
+CREATE UNIQUE INDEX domains_domain ON domains (domain);
+
+CREATE TABLE urls (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  url TEXT NOT NULL,
+  url_appeared_on TEXT DEFAULT NULL,
+  url_hash BLOB NOT NULL,
+  url_appeared_on_hash BLOB DEFAULT NULL,
+  domain_id INTEGER NOT NULL,
+  appeared_on_article_notification INTEGER DEFAULT NULL,
+  last_updated INTEGER DEFAULT NULL,
+  run_id INTEGER DEFAULT NULL
+);
+CREATE UNIQUE INDEX urls_unique_url_hash_and_url_appeared_on_hash ON urls (url_hash, url_appeared_on_hash);
+CREATE INDEX urls_domain_id ON urls (domain_id);
+CREATE INDEX urls_last_updated_domain_id ON urls (last_updated, domain_id);
+CREATE INDEX urls_run_id_domain_id ON urls (run_id, domain_id);
+CREATE INDEX urls_appeared_on_article_notification ON urls (appeared_on_article_notification);
+CREATE INDEX urls_url_appeared_on_hash ON urls (url_appeared_on_hash);
+
+CREATE TABLE article_state (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  article_url TEXT NOT NULL,
+  last_revid INTEGER DEFAULT NULL,
+  last_updated INTEGER DEFAULT NULL
+);
+CREATE UNIQUE INDEX article_state_unique_article_url ON article_state (article_url);
+
+CREATE TABLE runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  last_updated INTEGER NOT NULL,
+  finished INTEGER DEFAULT NULL,
+  status TEXT NOT NULL,
+  article_count INTEGER DEFAULT NULL,
+  link_count INTEGER DEFAULT NULL
+);
+CREATE INDEX runs_status ON runs (status);
+
+CREATE TABLE run_articles (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  run_id INTEGER NOT NULL,
+  article_url TEXT NOT NULL
+);
+CREATE UNIQUE INDEX run_articles_unique_run_id_and_article_url ON run_articles (run_id, article_url);
+
+CREATE TABLE domain_usage (
+  run_id INTEGER NOT NULL,
+  domain_id INTEGER NOT NULL,
+  link_count INTEGER NOT NULL,
+  article_count INTEGER NOT NULL,
+  status INTEGER DEFAULT NULL,
+  PRIMARY KEY (run_id, domain_id)
+);
+CREATE INDEX domain_usage_domain_id ON domain_usage (domain_id);
+
+CREATE TABLE domain_articles (
+  run_id INTEGER NOT NULL,
+  domain_id INTEGER NOT NULL,
+  url_appeared_on TEXT NOT NULL,
+  url_appeared_on_hash BLOB NOT NULL,
+  PRIMARY KEY (run_id, domain_id, url_appeared_on_hash)
+);
+
+CREATE TABLE run_metrics (
+  run_id INTEGER NOT NULL PRIMARY KEY,
+  article_count INTEGER NOT NULL,
+  domain_count INTEGER NOT NULL,
+  link_count INTEGER NOT NULL,
+  reliable_links INTEGER NOT NULL,
+  flagged_links INTEGER NOT NULL,
+  unrated_links INTEGER NOT NULL,
+  reliable_domains INTEGER NOT NULL,
+  flagged_domains INTEGER NOT NULL,
+  unrated_domains INTEGER NOT NULL
+);
+
+CREATE TABLE schema_version (
+  version INTEGER NOT NULL PRIMARY KEY,
+  name TEXT NOT NULL,
+  applied INTEGER NOT NULL
+);
+INSERT INTO schema_version (version, name, applied) VALUES
+  (1, 'crawl_runs', 0),
+  (2, 'hot_path_indexes', 0),
+  (3, 'url_hash_keys', 0),
+  (4, 'domain_usage', 0),
+  (5, 'run_metrics', 0),
+  (6, 'domain_articles', 0);
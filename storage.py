@@ -0,0 +1,440 @@
+"""
+Storage backends for the references database.
+
+Every module reaches the database through db.py, which gets its connections
+and its few dialect-specific statements from the backend chosen with the
+VSAFE_STORAGE environment variable:
+
+* mysql: the MySQL/MariaDB server configured in credentials.py (default)
+* sqlite:<path>: an embedded SQLite database file in WAL mode, created from
+  schema_sqlite.sql on first use
+
+Queries are written with %s placeholders for both backends.
+"""
+
+import os
+import sqlite3
+import threading
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+class MySQLStorage:
+    """
+    The MySQL/MariaDB backend, using pymysql.
+    """
+
+    name = "mysql"
+    migrations_dir = os.path.join(base_dir, "migrations")
+
+    def connect(self):
+        """
+        Connects to the MySQL database using the credentials provided.
+
+        Returns:
+            pymysql.connections.Connection: The new connection.
+        """
+        import pymysql
+        from credentials import hostname, dbname, username, password
+
+        return pymysql.connect(user=username,
+                               password=password,
+                               host=hostname,
+                               database=dbname)
+
+    def initialize(self, connection):
+        """
+        Prepares an empty database. The MySQL schema is imported from
+        schema.sql by hand, so there is nothing to do.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+        """
+
+    def ping(self, connection):
+        """
+        Reopens a connection the server has dropped.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+        """
+        connection.ping(reconnect=True)
+
+    def set_dict_rows(self, connection, enabled):
+        """
+        Makes the connection's cursors return rows as dicts or as tuples.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+            enabled (bool): Whether rows should be dicts.
+        """
+        import pymysql.cursors
+
+        connection.cursorclass = pymysql.cursors.DictCursor if enabled else pymysql.cursors.Cursor
+
+    def set_autocommit(self, connection, enabled):
+        """
+        Turns autocommit on or off.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+            enabled (bool): Whether to commit every statement immediately.
+        """
+        connection.autocommit(enabled)
+
+    def begin_snapshot(self, connection):
+        """
+        Starts a transaction that reads from one consistent snapshot.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+
+    def upsert_query(self, table, columns, key_columns, update_columns):
+        """
+        Builds an INSERT that updates the given columns of an existing row
+        with the same unique key.
+
+        Args:
+            table (str): Table name.
+            columns (Sequence[str]): Columns to insert.
+            key_columns (Sequence[str]): Columns of the unique key.
+            update_columns (Sequence[str]): Columns to update on conflict.
+
+        Returns:
+            str: The SQL statement.
+        """
+        updates = ", ".join(f"{column} = VALUES({column})" for column in update_columns)
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)})"
+            f" VALUES ({', '.join(['%s'] * len(columns))})"
+            f" ON DUPLICATE KEY UPDATE {updates}"
+        )
+
+    def insert_ignore_query(self, table, columns):
+        """
+        Builds an INSERT that skips rows violating a unique key.
+
+        Args:
+            table (str): Table name.
+            columns (Sequence[str]): Columns to insert.
+
+        Returns:
+            str: The SQL statement.
+        """
+        return (
+            f"INSERT IGNORE INTO {table} ({', '.join(columns)})"
+            f" VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+
+    def row_in_clause(self, key_columns, row_count):
+        """
+        Builds a condition matching rows whose key is in a list of tuples.
+
+        Args:
+            key_columns (Sequence[str]): Columns making up the key.
+            row_count (int): Number of key tuples.
+
+        Returns:
+            str: The SQL condition.
+        """
+        row_placeholder = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+        return f"({', '.join(key_columns)}) IN ({', '.join([row_placeholder] * row_count)})"
+
+    def explain_full_scans(self, connection, query, params):
+        """
+        Finds the tables a query reads without using an index.
+
+        Args:
+            connection (pymysql.connections.Connection): Database connection.
+            query (str): The query to explain.
+            params (tuple): The query's parameters.
+
+        Returns:
+            List[str]: Names or aliases of the fully scanned tables.
+        """
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN " + query, params)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.close()
+        return [row["table"] for row in rows if row["type"] == "ALL"]
+
+class SQLiteCursor:
+    """
+    Wraps a sqlite3 cursor to accept %s placeholders and to optionally
+    return rows as dicts, like pymysql cursors.
+    """
+
+    def __init__(self, cursor, dict_rows):
+        self.cursor = cursor
+        self.dict_rows = dict_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def convert(self, row):
+        if row is None or not self.dict_rows:
+            return row
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+    def execute(self, query, params=None):
+        self.cursor.execute(query.replace("%s", "?"), tuple(params or ()))
+        return self.cursor.rowcount
+
+    def executemany(self, query, seq_of_params):
+        self.cursor.executemany(query.replace("%s", "?"), [tuple(params) for params in seq_of_params])
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.convert(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self.convert(row) for row in self.cursor.fetchall()]
+
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnection:
+    """
+    Wraps a sqlite3 connection with the parts of the pymysql connection
+    interface used by this repository.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dict_rows = False
+
+    @property
+    def open(self):
+        return self.connection is not None
+
+    def cursor(self):
+        return SQLiteCursor(self.connection.cursor(), self.dict_rows)
+
+    def autocommit(self, enabled):
+        if enabled and self.connection.in_transaction:
+            self.connection.commit()
+        self.connection.isolation_level = None if enabled else ""
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class SQLiteStorage:
+    """
+    The embedded SQLite backend.
+    """
+
+    name = "sqlite"
+    migrations_dir = os.path.join(base_dir, "migrations", "sqlite")
+    schema_path = os.path.join(base_dir, "schema_sqlite.sql")
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the database file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.initialized = False
+
+    def connect(self):
+        """
+        Opens the database file in WAL mode, creating the schema on first use.
+
+        Returns:
+            SQLiteConnection: The new connection.
+        """
+        raw = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute("PRAGMA synchronous = NORMAL")
+        connection = SQLiteConnection(raw)
+        with self.lock:
+            if not self.initialized:
+                self.initialize(connection)
+                self.initialized = True
+        return connection
+
+    def initialize(self, connection):
+        """
+        Creates the schema in an empty database.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+        """
+        exists = connection.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        ).fetchone()
+        if not exists:
+            with open(self.schema_path, "r") as file:
+                connection.connection.executescript(file.read())
+
+    def ping(self, connection):
+        """
+        SQLite connections cannot be dropped, so there is nothing to check.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+        """
+
+    def set_dict_rows(self, connection, enabled):
+        """
+        Makes the connection's cursors return rows as dicts or as tuples.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+            enabled (bool): Whether rows should be dicts.
+        """
+        connection.dict_rows = enabled
+
+    def set_autocommit(self, connection, enabled):
+        """
+        Turns autocommit on or off.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+            enabled (bool): Whether to commit every statement immediately.
+        """
+        connection.autocommit(enabled)
+
+    def begin_snapshot(self, connection):
+        """
+        Starts a transaction. In WAL mode all its reads see one snapshot.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+        """
+        if not connection.connection.in_transaction:
+            connection.connection.execute("BEGIN")
+
+    def upsert_query(self, table, columns, key_columns, update_columns):
+        """
+        Builds an INSERT that updates the given columns of an existing row
+        with the same unique key.
+
+        Args:
+            table (str): Table name.
+            columns (Sequence[str]): Columns to insert.
+            key_columns (Sequence[str]): Columns of the unique key.
+            update_columns (Sequence[str]): Columns to update on conflict.
+
+        Returns:
+            str: The SQL statement.
+        """
+        updates = ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)})"
+            f" VALUES ({', '.join(['%s'] * len(columns))})"
+            f" ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+        )
+
+    def insert_ignore_query(self, table, columns):
+        """
+        Builds an INSERT that skips rows violating a unique key.
+
+        Args:
+            table (str): Table name.
+            columns (Sequence[str]): Columns to insert.
+
+        Returns:
+            str: The SQL statement.
+        """
+        return (
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)})"
+            f" VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+
+    def row_in_clause(self, key_columns, row_count):
+        """
+        Builds a condition matching rows whose key is in a list of tuples.
+        SQLite only accepts a row value list as a VALUES subquery.
+
+        Args:
+            key_columns (Sequence[str]): Columns making up the key.
+            row_count (int): Number of key tuples.
+
+        Returns:
+            str: The SQL condition.
+        """
+        row_placeholder = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+        if len(key_columns) == 1:
+            return f"{key_columns[0]} IN ({', '.join(['%s'] * row_count)})"
+        return f"({', '.join(key_columns)}) IN (VALUES {', '.join([row_placeholder] * row_count)})"
+
+    def explain_full_scans(self, connection, query, params):
+        """
+        Finds the tables a query reads without using an index.
+
+        Args:
+            connection (SQLiteConnection): Database connection.
+            query (str): The query to explain.
+            params (tuple): The query's parameters.
+
+        Returns:
+            List[str]: Names or aliases of the fully scanned tables.
+        """
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        scans = []
+        for _, _, _, detail in cursor.fetchall():
+            words = detail.split()
+            if len(words) >= 2 and words[0] == "SCAN" and "INDEX" not in words:
+                scans.append(words[1])
+        cursor.close()
+        return scans
+
+storage = None
+
+def get_storage():
+    """
+    Returns the backend selected by VSAFE_STORAGE, creating it on first use.
+
+    Returns:
+        MySQLStorage or SQLiteStorage: The storage backend.
+
+    Raises:
+        ValueError: If VSAFE_STORAGE names an unknown backend.
+    """
+    global storage
+    if storage is None:
+        setting = os.environ.get("VSAFE_STORAGE", "mysql")
+        if setting == "mysql":
+            storage = MySQLStorage()
+        elif setting.startswith("sqlite:"):
+            storage = SQLiteStorage(setting[len("sqlite:"):])
+        else:
+            raise ValueError(f"Unknown storage backend: {setting}")
+    return storage
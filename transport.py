@@ -0,0 +1,164 @@
+"""
+Pluggable HTTP transport with record and replay modes.
+
+All read-only requests to Wikipedia, the Domains Wikibase and Wikidata go
+through get(). The mode is chosen with the VSAFE_HTTP_MODE environment
+variable (or set_mode()):
+
+* live: requests go to the network (default)
+* record: requests go to the network and each response is also written,
+  gzip-compressed, to the store in VSAFE_HTTP_CACHE (default "http_cache")
+* replay: responses are served from the store and the network is never used
+
+Recording and replaying runs are dry runs (see dry_run()): pages are not saved
+to the wiki and alerts are not marked as notified, so a capture or benchmark
+run never edits the live pages and leaves the alerts to the next live run.
+
+Responses are keyed by method, URL and sorted query parameters, so a recorded
+run can be replayed deterministically for profiling and regression testing.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+import instrument
+
+MODES = ("live", "record", "replay")
+
+mode = os.environ.get("VSAFE_HTTP_MODE", "live")
+store_dir = os.environ.get("VSAFE_HTTP_CACHE", "http_cache")
+
+def set_mode(new_mode, new_store_dir=None):
+    """
+    Switches the transport mode for the rest of the process.
+
+    Args:
+        new_mode (str): One of "live", "record" or "replay".
+        new_store_dir (str, optional): Directory of the response store.
+
+    Raises:
+        ValueError: If the mode is not recognized.
+    """
+    global mode, store_dir
+    if new_mode not in MODES:
+        raise ValueError(f"Unknown HTTP transport mode: {new_mode}")
+    mode = new_mode
+    if new_store_dir is not None:
+        store_dir = new_store_dir
+
+def dry_run():
+    """
+    Tells whether writes to the wiki and the alert notification flags are to
+    be skipped, which is the case when recording or replaying.
+
+    Returns:
+        bool: True unless the transport is in live mode.
+    """
+    return mode != "live"
+
+def request_key(method, url, params=None):
+    """
+    Computes the store key of a request.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Request URL without query string parameters.
+        params (dict, optional): Query string parameters.
+
+    Returns:
+        str: A hex digest identifying the request.
+    """
+    query = urlencode(sorted((params or {}).items()), doseq=True)
+    return hashlib.sha256(f"{method} {url}?{query}".encode("utf-8")).hexdigest()
+
+def store_path(key):
+    """
+    Returns the path of a stored response, sharded by key prefix.
+
+    Args:
+        key (str): The store key returned by request_key.
+
+    Returns:
+        str: Path of the gzip-compressed JSON record.
+    """
+    return os.path.join(store_dir, key[:2], key + ".json.gz")
+
+def save_response(key, response):
+    """
+    Writes a response to the store atomically.
+
+    Args:
+        key (str): The store key returned by request_key.
+        response (requests.Response): The response to record.
+    """
+    path = store_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        "url": response.url,
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "encoding": response.encoding,
+        "body": response.content.decode("latin-1"),
+    }
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as file:
+        file.write(json.dumps(record).encode("utf-8"))
+    os.replace(temp_path, path)
+
+def load_response(key):
+    """
+    Reads a response from the store.
+
+    Args:
+        key (str): The store key returned by request_key.
+
+    Returns:
+        requests.Response: The recorded response.
+
+    Raises:
+        LookupError: If no response was recorded for the request.
+    """
+    path = store_path(key)
+    try:
+        with gzip.open(path, "rb") as file:
+            record = json.loads(file.read().decode("utf-8"))
+    except FileNotFoundError:
+        raise LookupError(f"No recorded response for request {key}") from None
+
+    response = requests.Response()
+    response.url = record["url"]
+    response.status_code = record["status_code"]
+    response.headers = CaseInsensitiveDict(record["headers"])
+    response.encoding = record["encoding"]
+    response._content = record["body"].encode("latin-1")
+    return response
+
+def get(url, params=None, session=None, **kwargs):
+    """
+    Performs a GET request through the configured transport.
+
+    Args:
+        url (str): Request URL.
+        params (dict, optional): Query string parameters.
+        session (requests.Session, optional): Session to use for live requests.
+        **kwargs: Further arguments for requests, such as timeout.
+
+    Returns:
+        requests.Response: The live or recorded response.
+    """
+    key = request_key("GET", url, params)
+    if mode == "replay":
+        return load_response(key)
+
+    start = time.perf_counter()
+    response = (session or requests).get(url, params=params, **kwargs)
+    instrument.record_http(url, time.perf_counter() - start, response.status_code)
+    if mode == "record":
+        save_response(key, response)
+    return response
@@ -10,29 +10,82 @@ status_to_template = {
     6: "blocked"
 }
 
-def to_wikilinks(url_string):
+# Domain statuses counted in each bucket of the metrics dashboard
+status_buckets = {
+    "reliable": (1, 2),
+    "flagged": (3, 4, 5, 6),
+    "unrated": (None,),
+}
+
+# Unrated domains linked at least this many times are listed as frequent
+# domains on the report and raise frequent-domain alerts
+FREQUENT_DOMAIN_MIN_LINKS = 10
+
+def status_condition(bucket, column="status"):
+    """
+    Builds an SQL condition matching the statuses of a dashboard bucket.
+
+    Args:
+        bucket (str): Name of the bucket in status_buckets.
+        column (str, optional): The status column, qualified if needed.
+
+    Returns:
+        str: The parenthesized condition.
+    """
+    statuses = status_buckets[bucket]
+    conditions = []
+    known_statuses = [str(status) for status in statuses if status is not None]
+    if known_statuses:
+        conditions.append(f"{column} IN ({', '.join(known_statuses)})")
+    if None in statuses:
+        conditions.append(f"{column} IS NULL")
+    return "(" + " OR ".join(conditions) + ")"
+
+def listed_domain_condition(table):
+    """
+    Builds an SQL condition selecting the domain_usage rows of the domains
+    whose articles the report and the alerts list: flagged domains and
+    frequently used unrated ones.
+
+    Args:
+        table (str): Name or alias of the domain_usage table in the query.
+
+    Returns:
+        str: The parenthesized condition.
+    """
+    return (
+        f"({status_condition('flagged', f'{table}.status')}"
+        f" OR ({status_condition('unrated', f'{table}.status')}"
+        f" AND {table}.link_count >= {FREQUENT_DOMAIN_MIN_LINKS}))"
+    )
+
+def url_to_title(url):
+    """
+    Extracts the page title from a Wikipedia article URL.
+
+    Args:
+        url (str): The URL of the Wikipedia article.
+
+    Returns:
+        str: The article title, or None if the URL is not an article URL.
+    """
+    path = urlparse(url.strip()).path
+    if not path.startswith('/wiki/'):
+        return None
+    return unquote(path[6:]).replace('_', ' ')
+
+def to_wikilinks(urls):
     """
-    Converts a string of URLs into a string of MediaWiki-style wiki links
+    Converts Wikipedia article URLs into a string of MediaWiki-style wiki links
 
     Args:
-        url_string (str): A string containing one or more comma-separated URLs.
+        urls (Iterable[str]): The article URLs.
 
     Returns:
         str: A string containing the corresponding Wikipedia wikilinks, separated by commas.
     """
-    url_string = url_string.replace(',https://', '\thttps://')
-    urls = url_string.split('\t')
-    wikilinks = []
-    for url in urls:
-        url = url.strip()
-        parsed_url = urlparse(url)
-        path = parsed_url.path
-        if path.startswith('/wiki/'):
-            title = unquote(path[6:]).replace('_', ' ')
-            wikilink = f"[[{title}]]"
-            wikilinks.append(wikilink)
-    formatted_links = ', '.join(wikilinks)
-    return formatted_links
+    titles = (url_to_title(url) for url in urls)
+    return ', '.join(f"[[{title}]]" for title in titles if title is not None)
 
 def get_history_link(article_title):
     """